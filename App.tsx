@@ -18,9 +18,8 @@ import UserManager from './components/UserManager';
 import ReportManager from './components/ReportManager';
 import ShippingManager from './components/ShippingManager';
 import Login from './components/Login';
-import { ProductionOrder, ReturnLog, OrderStatus, Customer, ProductModel, User, UserRole, ShippingNote, Priority, Payment } from './types';
-import { SAMPLE_ORDER, SAMPLE_CUSTOMER, DEFAULT_USERS, INITIAL_STAGES } from './constants';
-import { generateId } from './utils';
+import { ProductionOrder, ReturnLog, OrderStatus, Customer, ProductModel, User, UserRole, ShippingNote, Payment } from './types';
+import { SAMPLE_ORDER, SAMPLE_CUSTOMER, DEFAULT_USERS } from './constants';
 import { ordersAPI, customersAPI, modelsAPI, shippingAPI, paymentsAPI, returnsAPI, usersAPI } from './api';
 
 const SidebarLink: React.FC<{ to: string; icon: React.ReactNode; label: string; isSubItem?: boolean; badge?: number; onNavigate?: () => void }> = ({ to, icon, label, isSubItem, badge, onNavigate }) => {
@@ -178,34 +177,22 @@ const App: React.FC = () => {
 
   const addReturn = async (newReturn: ReturnLog) => {
     try {
-      await returnsAPI.create(newReturn);
+      // Dùng chung endpoint batch (1 dòng) để cùng transaction và cùng cách cấp mã lệnh bù
+      const result = await returnsAPI.createBatch({
+        originalOrderId: newReturn.originalOrderId,
+        lines: [{
+          id: newReturn.id,
+          color: newReturn.color,
+          size: newReturn.size,
+          quantity: newReturn.quantity,
+          reason: newReturn.reason,
+          date: newReturn.date
+        }]
+      });
       setReturns(prev => [newReturn, ...prev]);
 
-      const originalOrder = orders.find(o => o.id === newReturn.originalOrderId);
-      if (originalOrder) {
-        const remakeOrder: ProductionOrder = {
-          ...originalOrder,
-          id: generateId(),
-          orderCode: `${originalOrder.orderCode}-BÙ`,
-          parentOrderId: originalOrder.id,
-          totalQuantity: newReturn.quantity,
-          priority: Priority.HIGH,
-          priorityReason: `Làm bù cho hàng lỗi: ${newReturn.reason}`,
-          stages: INITIAL_STAGES,
-          details: originalOrder.details.map(d => {
-            if (d.color === newReturn.color) {
-              const newSizes = { ...d.sizes, [`size${newReturn.size}`]: newReturn.quantity };
-              Object.keys(newSizes).forEach(k => {
-                if (k !== `size${newReturn.size}`) (newSizes as any)[k] = 0;
-              });
-              return { ...d, sizes: newSizes, total: newReturn.quantity };
-            }
-            return { ...d, total: 0, sizes: {} as any };
-          }).filter(d => d.total > 0),
-          createdAt: new Date().toISOString()
-        };
-        await ordersAPI.create(remakeOrder);
-        setOrders(prev => [remakeOrder, ...prev]);
+      if (result.remakeOrder) {
+        setOrders(prev => [result.remakeOrder as ProductionOrder, ...prev]);
       }
     } catch (error) {
       console.error('Error adding return:', error);
@@ -218,70 +205,22 @@ const App: React.FC = () => {
     if (newReturns.length === 0) return;
     
     try {
-      // Tạo tất cả return logs
-      const createdReturns: ReturnLog[] = [];
-      for (const newReturn of newReturns) {
-        await returnsAPI.create(newReturn);
-        createdReturns.push(newReturn);
-      }
-      setReturns(prev => [...createdReturns, ...prev]);
-
-      // Gộp các returns cùng màu và cùng lý do thành 1 lệnh bù
-      const originalOrder = orders.find(o => o.id === newReturns[0].originalOrderId);
-      if (!originalOrder) return;
-
-      // Nhóm theo màu và lý do
-      const groupedByColorAndReason: Record<string, ReturnLog[]> = {};
-      newReturns.forEach(ret => {
-        const key = `${ret.color}|${ret.reason}`;
-        if (!groupedByColorAndReason[key]) {
-          groupedByColorAndReason[key] = [];
-        }
-        groupedByColorAndReason[key].push(ret);
+      // Ghi tất cả return logs và tạo 1 lệnh bù gộp trong cùng 1 transaction
+      const result = await returnsAPI.createBatch({
+        originalOrderId: newReturns[0].originalOrderId,
+        lines: newReturns.map(ret => ({
+          id: ret.id,
+          color: ret.color,
+          size: ret.size,
+          quantity: ret.quantity,
+          reason: ret.reason,
+          date: ret.date
+        }))
       });
+      setReturns(prev => [...newReturns, ...prev]);
 
-      // Tạo lệnh bù cho mỗi nhóm
-      for (const [key, returns] of Object.entries(groupedByColorAndReason)) {
-        const [color, reason] = key.split('|');
-        const totalQuantity = returns.reduce((sum, r) => sum + r.quantity, 0);
-        
-        // Tạo object sizes từ tất cả returns trong nhóm
-        const sizesMap: Record<string, number> = {};
-        returns.forEach(ret => {
-          sizesMap[`size${ret.size}`] = ret.quantity;
-        });
-
-        const remakeOrder: ProductionOrder = {
-          ...originalOrder,
-          id: generateId(),
-          orderCode: `${originalOrder.orderCode}-BÙ`,
-          parentOrderId: originalOrder.id,
-          totalQuantity: totalQuantity,
-          priority: Priority.HIGH,
-          priorityReason: `Làm bù cho hàng lỗi: ${reason}`,
-          stages: INITIAL_STAGES,
-          details: originalOrder.details.map(d => {
-            if (d.color === color) {
-              // Tạo sizes object mới từ sizesMap, giữ nguyên cấu trúc của sizes gốc
-              const newSizes: any = {};
-              // Copy tất cả sizes từ detail gốc và set về 0
-              Object.keys(d.sizes).forEach(k => {
-                newSizes[k] = sizesMap[k] || 0;
-              });
-              // Thêm các size mới từ returns nếu chưa có trong detail gốc
-              Object.entries(sizesMap).forEach(([sizeKey, qty]) => {
-                if (!(sizeKey in newSizes)) {
-                  newSizes[sizeKey] = qty;
-                }
-              });
-              return { ...d, sizes: newSizes, total: totalQuantity };
-            }
-            return { ...d, total: 0, sizes: {} as any };
-          }).filter(d => d.total > 0),
-          createdAt: new Date().toISOString()
-        };
-        await ordersAPI.create(remakeOrder);
-        setOrders(prev => [remakeOrder, ...prev]);
+      if (result.remakeOrder) {
+        setOrders(prev => [result.remakeOrder as ProductionOrder, ...prev]);
       }
     } catch (error) {
       console.error('Error adding returns:', error);
@@ -581,7 +520,7 @@ const App: React.FC = () => {
           </header>
           <main className="flex-1 overflow-y-auto p-4 md:p-8 custom-scrollbar bg-[#f8fafc] print:block print:overflow-visible print:bg-white print:p-0">
             <Routes>
-              <Route path="/" element={<Dashboard orders={orders} returns={returns} shippingNotes={shippingNotes} payments={payments} />} />
+              <Route path="/" element={<Dashboard orders={orders} returns={returns} shippingNotes={shippingNotes} payments={payments} customers={customers} />} />
               <Route path="/orders" element={<OrderList orders={activeOrders} onReorder={reorderOrders} onDelete={deleteOrder} title="Điều hành sản xuất" user={currentUser} />} />
               <Route path="/cancelled" element={currentUser.role === UserRole.ADMIN ? <OrderList orders={cancelledOrders} onReorder={() => { }} onDelete={deleteOrder} title="Thư mục đã hủy" user={currentUser} /> : <Navigate to="/orders" />} />
               <Route path="/create-order" element={currentUser.permissions.canEdit ? <OrderForm onSave={addOrder} customers={customers} models={models} orders={orders} /> : <Navigate to="/orders" />} />
@@ -590,7 +529,7 @@ const App: React.FC = () => {
               <Route path="/shipping" element={<ShippingManager orders={orders} shippingNotes={shippingNotes} onAdd={addShippingNote} onUpdate={updateShippingNote} onDelete={deleteShippingNote} user={currentUser} />} />
               <Route path="/returns" element={<ReturnManager returns={returns} orders={orders} />} />
               <Route path="/customers" element={<CustomerManager customers={customers} orders={orders} shippingNotes={shippingNotes} payments={payments} onAdd={addCustomer} onUpdate={updateCustomer} onAddPayment={addPayment} onDeletePayment={deletePayment} onReorderOrders={reorderOrders} user={currentUser} />} />
-              <Route path="/models" element={<ModelManager models={models.filter(m => !m.isArchived)} onAdd={addModel} onUpdate={updateModel} onDelete={archiveModel} user={currentUser} />} />
+              <Route path="/models" element={<ModelManager models={models.filter(m => !m.isArchived)} onAdd={addModel} onUpdate={updateModel} onDelete={archiveModel} user={currentUser} onLoadDetail={modelsAPI.getById} />} />
               <Route path="/models-archive" element={<ModelManager models={models.filter(m => m.isArchived)} onAdd={addModel} onUpdate={updateModel} onDelete={permanentlyDeleteModel} onRestore={restoreModel} isArchiveView user={currentUser} />} />
               <Route path="/users" element={currentUser.role === UserRole.ADMIN ? <UserManager users={users} currentUser={currentUser} onAdd={addUser} onUpdate={updateUser} onDelete={deleteUser} /> : <Navigate to="/orders" />} />
               <Route path="/reports" element={<ReportManager orders={orders} customers={customers} returns={returns} />} />
@@ -50,6 +50,9 @@ export const ordersAPI = {
 export const customersAPI = {
     getAll: () => apiCall<any[]>('/customers'),
     getById: (id: string) => apiCall<any>(`/customers/${id}`),
+    getTimeline: (id: string, cursor?: string, limit = 50) => apiCall<any>(
+        `/customers/${id}/timeline?limit=${limit}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`
+    ),
     create: (customer: any) => apiCall<any>('/customers', {
         method: 'POST',
         body: JSON.stringify(customer),
@@ -115,6 +118,11 @@ export const returnsAPI = {
         method: 'POST',
         body: JSON.stringify(returnLog),
     }),
+    // Ghi nhiều dòng trả hàng + tạo 1 lệnh bù trong cùng 1 transaction
+    createBatch: (batch: any) => apiCall<any>('/returns/batch', {
+        method: 'POST',
+        body: JSON.stringify(batch),
+    }),
 };
 
 // Users API (Authentication)
@@ -137,6 +145,46 @@ export const usersAPI = {
     }),
 };
 
+// Search API (không phân biệt dấu tiếng Việt)
+export const searchAPI = {
+    search: (q: string, limit = 20, type?: string) => apiCall<any>(
+        `/search?q=${encodeURIComponent(q)}&limit=${limit}${type ? `&type=${type}` : ''}`
+    ),
+};
+
+// Schedule API (dự báo ngày hoàn thành & rủi ro trễ hạn)
+export const scheduleAPI = {
+    getAll: (risk?: string) => apiCall<any>(`/schedule${risk ? `?risk=${risk}` : ''}`),
+    getByOrder: (orderId: string) => apiCall<any>(`/schedule/${orderId}`),
+};
+
+// Archive API (lưu trữ lệnh cũ đã hoàn thành/hủy)
+export const archiveAPI = {
+    run: (options?: { olderThanDays?: number; batchSize?: number }) => apiCall<any>('/archive/run', {
+        method: 'POST',
+        body: JSON.stringify(options || {}),
+    }),
+    getRuns: () => apiCall<any[]>('/archive/runs'),
+};
+
+// Analytics API (tỷ lệ lỗi theo mã hàng, size, màu, khách hàng, đế, phom)
+export const analyticsAPI = {
+    getDefects: (params: { dimension?: string; from?: string; to?: string; granularity?: string; top?: number; sort?: string }) =>
+        apiCall<any>(`/analytics/defects?${new URLSearchParams(
+            Object.entries(params).filter(([, v]) => v !== undefined).map(([k, v]) => [k, String(v)])
+        ).toString()}`),
+};
+
+// Jobs API (tác vụ nền: xuất dữ liệu, lưu trữ, dựng lại chỉ mục)
+export const jobsAPI = {
+    submit: (type: string, payload?: any, maxAttempts?: number) => apiCall<any>('/jobs', {
+        method: 'POST',
+        body: JSON.stringify({ type, payload, maxAttempts }),
+    }),
+    getAll: (status?: string) => apiCall<any[]>(`/jobs${status ? `?status=${status}` : ''}`),
+    getById: (id: string) => apiCall<any>(`/jobs/${id}`),
+};
+
 // Health check
 export const healthCheck = () => apiCall<{ status: string; message: string }>('/health');
 
@@ -1,12 +1,31 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, make_response, request, g, has_request_context
 from flask_cors import CORS
 import mysql.connector
 from mysql.connector import Error
+import atexit
+import base64
+import binascii
+import bisect
+import functools
+import hashlib
+import heapq
 import json
-from datetime import datetime
+import logging
+import logging.handlers
+import multiprocessing
+from datetime import datetime, timedelta
 from email.utils import parsedate_to_datetime
 import os
+import queue
 import re
+import sys
+import threading
+import time
+import unicodedata
+import uuid
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 app = Flask(__name__)
 CORS(app, resources={
@@ -20,6 +39,142 @@ CORS(app, resources={
     }
 })
 
+# ============ LOGGING ============
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Strings longer than this are truncated in log fields
+LOG_FIELD_MAX_CHARS = int(os.getenv('LOG_FIELD_MAX_CHARS', 200))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Per error signature: log the first LOG_ERROR_BURST in each window, then 1 in LOG_ERROR_SAMPLE_RATE
+LOG_ERROR_WINDOW_SECONDS = int(os.getenv('LOG_ERROR_WINDOW_SECONDS', 60))
+LOG_ERROR_BURST = int(os.getenv('LOG_ERROR_BURST', 5))
+LOG_ERROR_SAMPLE_RATE = int(os.getenv('LOG_ERROR_SAMPLE_RATE', 50))
+
+# Field names whose values are never written to the log
+REDACTED_LOG_FIELDS = {'password', 'productImage', 'evidenceImage', 'technicalDocument'}
+
+def sanitize_for_log(value, depth=0):
+    """Redact sensitive fields and truncate large values before they are logged"""
+    if depth > 4:
+        return '<nested>'
+    if isinstance(value, dict):
+        return {
+            key: (f'<redacted {len(str(item))} chars>' if key in REDACTED_LOG_FIELDS and item else sanitize_for_log(item, depth + 1))
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        items = [sanitize_for_log(item, depth + 1) for item in value[:20]]
+        if len(value) > 20:
+            items.append(f'<+{len(value) - 20} items>')
+        return items
+    if isinstance(value, str):
+        if value.startswith('data:'):
+            return f'<data-url {len(value)} chars>'
+        if len(value) > LOG_FIELD_MAX_CHARS:
+            return value[:LOG_FIELD_MAX_CHARS] + f'...<+{len(value) - LOG_FIELD_MAX_CHARS} chars>'
+        return value
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return sanitize_for_log(str(value), depth + 1)
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line with request context and sanitised fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'requestId': getattr(record, 'request_id', None),
+            'route': getattr(record, 'route', None)
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(sanitize_for_log(fields))
+        if getattr(record, 'suppressed', 0):
+            entry['suppressedSinceLast'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)[-4000:]
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RequestContextFilter(logging.Filter):
+    """Attach the request id and route; runs in the logging thread's caller"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.route = f"{request.method} {request.path}"
+        return True
+
+class ErrorSamplingFilter(logging.Filter):
+    """Rate-limit repeated errors with the same message and exception type"""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR:
+            return True
+        signature = (record.name, record.msg, record.exc_info[0] if record.exc_info else None)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(signature)
+            if window is None or now - window['start'] > LOG_ERROR_WINDOW_SECONDS:
+                window = self._windows[signature] = {'start': now, 'seen': 0, 'suppressed': window['suppressed'] if window else 0}
+            window['seen'] += 1
+            if window['seen'] > LOG_ERROR_BURST and (window['seen'] - LOG_ERROR_BURST) % LOG_ERROR_SAMPLE_RATE:
+                window['suppressed'] += 1
+                return False
+            record.suppressed = window['suppressed']
+            window['suppressed'] = 0
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def configure_logging():
+    """Route the app logger through a bounded queue drained by a background thread"""
+    log = logging.getLogger('binhvuong')
+    if log.handlers:
+        return log
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue)
+    handler.setFormatter(JsonLogFormatter())
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(ErrorSamplingFilter())
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    atexit.register(listener.stop)
+    log.addHandler(handler)
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+    return log
+
+logger = configure_logging()
+
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+
+@app.after_request
+def add_request_id_header(response):
+    if g.get('request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    return response
+
 # Helper function to convert ISO datetime to MySQL format
 def convert_datetime(dt_string):
     """Convert ISO 8601 datetime string to MySQL datetime format"""
@@ -35,6 +190,12 @@ def convert_datetime(dt_string):
     except:
         return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+def stored_datetime(value):
+    """convert_datetime as a datetime: wall-clock time as sent, any offset dropped"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    return datetime.strptime(convert_datetime(value), '%Y-%m-%d %H:%M:%S')
+
 # Helper function to convert various date formats to MySQL DATE format
 def convert_date(date_string):
     """Convert various date/datetime string formats to MySQL DATE format (YYYY-MM-DD)"""
@@ -78,7 +239,7 @@ def convert_date(date_string):
         pass
     
     # If all parsing fails, return current date
-    print(f"Warning: Could not parse date '{date_string}', using current date")
+    logger.warning("Could not parse date, using current date", extra={'fields': {'value': date_string}})
     return datetime.now().strftime('%Y-%m-%d')
 
 # Add security headers for Chrome's private network access
@@ -103,9 +264,12 @@ def get_db_connection():
     """Create and return a database connection"""
     try:
         connection = mysql.connector.connect(**DB_CONFIG)
+        if QUERY_PROFILING and has_request_context():
+            query_log = g.setdefault('query_log', [])
+            return ProfiledConnection(connection, query_log)
         return connection
     except Error as e:
-        print(f"Error connecting to MySQL: {e}")
+        logger.error("Error connecting to MySQL", extra={'fields': {'error': str(e)}})
         return None
 
 def init_database():
@@ -122,22 +286,402 @@ def init_database():
         cursor.execute(f"CREATE DATABASE IF NOT EXISTS {DB_CONFIG['database']} CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
         cursor.close()
         conn.close()
-        print(f"Database '{DB_CONFIG['database']}' ready")
+        logger.info("Database ready", extra={'fields': {'database': DB_CONFIG['database']}})
+    except Error as e:
+        logger.error("Error initializing database", extra={'fields': {'error': str(e)}})
+
+# ============ QUERY PROFILER ============
+
+# Opt-in: QUERY_PROFILING=1 wraps every request-scoped cursor with timing
+QUERY_PROFILING = os.getenv('QUERY_PROFILING', '').lower() in ('1', 'true', 'yes')
+# Queries slower than this get an EXPLAIN captured in the background
+PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', 100))
+# Identical statements repeated this often in one request are flagged as N+1
+PROFILE_REPEAT_THRESHOLD = int(os.getenv('PROFILE_REPEAT_THRESHOLD', 3))
+PROFILE_REPORT_PATH = os.getenv('PROFILE_REPORT_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'query-profile.json'))
+
+route_profiles = {}
+route_profiles_lock = threading.Lock()
+# EXPLAINs run here so they never add latency to the profiled response
+explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profiler-explain')
+
+def normalize_statement(statement):
+    """Collapse whitespace and IN-lists so one query shape maps to one key"""
+    statement = re.sub(r'\s+', ' ', str(statement)).strip()
+    return re.sub(r'IN \((?:%s, )*%s\)', 'IN (...)', statement)
+
+class ProfiledCursor:
+    """Cursor proxy that records each statement's duration, rows returned and rows examined"""
+
+    def __init__(self, cursor, profiled_conn):
+        self._cursor = cursor
+        self._profiled_conn = profiled_conn
+        self._entry = None
+
+    def _record(self, method, operation, params):
+        self._profiled_conn.collect_rows_examined()
+        started = time.perf_counter()
+        try:
+            return method(operation, params)
+        finally:
+            self._entry = {
+                'statement': normalize_statement(operation),
+                'sql': operation,
+                'params': params,
+                'ms': (time.perf_counter() - started) * 1000,
+                'rows': max(self._cursor.rowcount, 0),
+                'rowsExamined': None
+            }
+            self._profiled_conn.statement_finished(self._entry)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        return self._record(lambda op, p: self._cursor.execute(op, p, *args, **kwargs), operation, params)
+
+    def executemany(self, operation, seq_params):
+        return self._record(self._cursor.executemany, operation, seq_params)
+
+    def _fetched(self, rows):
+        if self._entry is not None:
+            self._entry['rows'] = max(self._cursor.rowcount, 0)
+        self._profiled_conn.collect_rows_examined()
+        return rows
+
+    def fetchall(self):
+        return self._fetched(self._cursor.fetchall())
+
+    def fetchone(self):
+        return self._fetched(self._cursor.fetchone())
+
+    def close(self):
+        result = self._cursor.close()
+        self._profiled_conn.collect_rows_examined()
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class ProfiledConnection:
+    """Connection proxy handing out ProfiledCursor instances.
+
+    Rows examined come from performance_schema.events_statements_history: once a
+    statement's result has been read, the newest history row of this session is
+    that statement. If performance_schema is unavailable they stay None.
+    """
+
+    def __init__(self, conn, query_log):
+        self._conn = conn
+        self._query_log = query_log
+        self._pending = None
+        self._thread_id = self._session_thread_id()
+
+    def _session_thread_id(self):
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute("SELECT THREAD_ID FROM performance_schema.threads WHERE PROCESSLIST_ID = CONNECTION_ID()")
+            row = cursor.fetchone()
+            cursor.close()
+            return row[0] if row else None
+        except Error:
+            return None
+
+    def statement_finished(self, entry):
+        self._query_log.append(entry)
+        self._pending = entry
+        self.collect_rows_examined()
+
+    def collect_rows_examined(self):
+        """Fill in rowsExamined for the last statement once its result is consumed"""
+        entry = self._pending
+        if entry is None or self._thread_id is None or getattr(self._conn, 'unread_result', False):
+            return
+        self._pending = None
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute("""
+                SELECT ROWS_EXAMINED FROM performance_schema.events_statements_history
+                WHERE THREAD_ID = %s ORDER BY EVENT_ID DESC LIMIT 1
+            """, (self._thread_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            entry['rowsExamined'] = int(row[0]) if row else None
+        except Error:
+            self._thread_id = None
+
+    def _finish_statement(self):
+        # Anything run after this (COMMIT, ROLLBACK) would shadow a still-pending statement
+        self.collect_rows_examined()
+        self._pending = None
+
+    def commit(self):
+        self._finish_statement()
+        return self._conn.commit()
+
+    def rollback(self):
+        self._finish_statement()
+        return self._conn.rollback()
+
+    def close(self):
+        self._finish_statement()
+        return self._conn.close()
+
+    def cursor(self, *args, **kwargs):
+        return ProfiledCursor(self._conn.cursor(*args, **kwargs), self)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+def _explain(entry):
+    """Run EXPLAIN for a slow statement on a separate, unprofiled connection"""
+    if not re.match(r'\s*(SELECT|UPDATE|DELETE)\b', entry['sql'], re.IGNORECASE):
+        return None
+    try:
+        conn = mysql.connector.connect(**DB_CONFIG)
+    except Error:
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute('EXPLAIN ' + entry['sql'], entry['params'])
+        plan = cursor.fetchall()
+        cursor.close()
+        return plan
     except Error as e:
-        print(f"Error initializing database: {e}")
+        return [{'error': str(e)}]
+    finally:
+        conn.close()
+
+def _capture_explain(route, entry):
+    """Background task: attach the EXPLAIN plan of a slow statement to its route stats"""
+    plan = _explain(entry)
+    with route_profiles_lock:
+        stats = route_profiles[route]['statements'][entry['statement']]
+        stats.pop('explainPending', None)
+        if plan is None:
+            return
+        stats['explain'] = plan
+        stats['explainRows'] = sum(int(row.get('rows') or 0) for row in plan)
+        stats['filesort'] = any('filesort' in str(row.get('Extra') or '') for row in plan)
+
+def _record_route_profile(route, query_log):
+    """Fold one request's queries into the per-route report; returns the request summary"""
+    counts = defaultdict(int)
+    for entry in query_log:
+        counts[entry['statement']] += 1
+    repeated = {statement: n for statement, n in counts.items() if n >= PROFILE_REPEAT_THRESHOLD}
+    slow = [entry for entry in query_log if entry['ms'] >= PROFILE_SLOW_MS]
+    rows_examined = sum(entry['rowsExamined'] or 0 for entry in query_log)
+
+    with route_profiles_lock:
+        profile = route_profiles.setdefault(route, {'requests': 0, 'queries': 0, 'totalMs': 0.0, 'rowsExamined': 0, 'maxQueriesPerRequest': 0, 'statements': {}})
+        profile['requests'] += 1
+        profile['queries'] += len(query_log)
+        profile['totalMs'] += sum(entry['ms'] for entry in query_log)
+        profile['rowsExamined'] += rows_examined
+        profile['maxQueriesPerRequest'] = max(profile['maxQueriesPerRequest'], len(query_log))
+        for entry in query_log:
+            stats = profile['statements'].setdefault(entry['statement'], {'count': 0, 'totalMs': 0.0, 'maxMs': 0.0, 'rowsReturned': 0, 'rowsExamined': 0, 'maxRowsExamined': 0, 'maxPerRequest': 0})
+            stats['count'] += 1
+            stats['totalMs'] += entry['ms']
+            stats['maxMs'] = max(stats['maxMs'], entry['ms'])
+            stats['rowsReturned'] += entry['rows']
+            stats['rowsExamined'] += entry['rowsExamined'] or 0
+            stats['maxRowsExamined'] = max(stats['maxRowsExamined'], entry['rowsExamined'] or 0)
+            stats['maxPerRequest'] = max(stats['maxPerRequest'], counts[entry['statement']])
+            if entry['statement'] in repeated:
+                stats['repeatedInRequest'] = True
+        for entry in slow:
+            stats = profile['statements'][entry['statement']]
+            if 'explain' in stats or stats.get('explainPending'):
+                continue
+            stats['explainPending'] = True
+            explain_executor.submit(_capture_explain, route, entry)
+
+    return {
+        'queries': len(query_log),
+        'totalMs': round(sum(entry['ms'] for entry in query_log), 2),
+        'rows': sum(entry['rows'] for entry in query_log),
+        'rowsExamined': rows_examined,
+        'slow': len(slow),
+        'repeated': repeated
+    }
+
+def profiler_report():
+    """Per-route report with stable ordering and rounding, suitable for diffing"""
+    with route_profiles_lock:
+        report = json.loads(json.dumps(route_profiles, default=str))
+    for profile in report.values():
+        profile['totalMs'] = round(profile['totalMs'], 1)
+        profile['avgQueriesPerRequest'] = round(profile['queries'] / profile['requests'], 2)
+        for stats in profile['statements'].values():
+            stats['avgMs'] = round(stats['totalMs'] / stats['count'], 2)
+            stats['totalMs'] = round(stats['totalMs'], 1)
+            stats['maxMs'] = round(stats['maxMs'], 1)
+    return report
+
+def dump_profiler_report():
+    """Write the per-route report to PROFILE_REPORT_PATH; returns the path"""
+    path = PROFILE_REPORT_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(profiler_report(), f, indent=2, sort_keys=True, ensure_ascii=False)
+    return path
+
+@app.after_request
+def profile_request(response):
+    query_log = g.pop('query_log', None)
+    if query_log is None:
+        return response
+    route = f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+    summary = _record_route_profile(route, query_log)
+    response.headers['X-Query-Count'] = str(summary['queries'])
+    response.headers['X-Query-Time-Ms'] = str(summary['totalMs'])
+    response.headers['X-Rows-Examined'] = str(summary['rowsExamined'])
+    logger.info("Query profile", extra={'fields': {
+        'queries': summary['queries'], 'queryMs': summary['totalMs'],
+        'rows': summary['rows'], 'rowsExamined': summary['rowsExamined'],
+        'slowQueries': summary['slow']
+    }})
+    for statement, count in summary['repeated'].items():
+        logger.warning("Possible N+1 query", extra={'fields': {'count': count, 'statement': statement}})
+    return response
+
+@app.route('/api/profiler/report', methods=['GET', 'POST'])
+def get_profiler_report():
+    """GET returns the per-route query report; POST also writes it to disk"""
+    if not QUERY_PROFILING:
+        return jsonify({'error': 'Query profiling is disabled (set QUERY_PROFILING=1)'}), 404
+    if request.method == 'POST':
+        path = dump_profiler_report()
+        return jsonify({'message': 'Profiler report written', 'path': path})
+    return jsonify(profiler_report())
+
+if QUERY_PROFILING:
+    atexit.register(dump_profiler_report)
+
+# ============ REQUEST COALESCING ============
+
+# How long a finished read may still be handed to identical requests (0 = in-flight only).
+# Writes in this process invalidate it immediately; other worker processes are not seen.
+COALESCE_WINDOW_MS = float(os.getenv('COALESCE_WINDOW_MS', 100))
+# Followers stop waiting for a stuck leader after this and run the query themselves
+COALESCE_WAIT_SECONDS = float(os.getenv('COALESCE_WAIT_SECONDS', 30))
+
+coalesce_lock = threading.Lock()
+coalesce_flights = {}
+# Set while finished flights may still hold bodies; the sweeper drops them after the window
+coalesce_sweep_needed = threading.Event()
+coalesce_sweeper_started = False
+write_generation = 0
+
+def bump_write_generation():
+    """Mark that data may have changed, so no read started earlier is shared again"""
+    global write_generation
+    with coalesce_lock:
+        write_generation += 1
+
+@app.before_request
+def mark_write_started():
+    if request.method in ('POST', 'PUT', 'DELETE'):
+        bump_write_generation()
+
+@app.after_request
+def mark_write_finished(response):
+    if request.method in ('POST', 'PUT', 'DELETE'):
+        bump_write_generation()
+    return response
+
+class _Flight:
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.finished_at = None
+        self.result = None
+
+def _prune_flights(now):
+    """Drop finished flights past their window or superseded by a write; call under coalesce_lock"""
+    for key, flight in list(coalesce_flights.items()):
+        if flight.finished_at is None:
+            continue
+        if flight.generation != write_generation or (now - flight.finished_at) * 1000 > COALESCE_WINDOW_MS:
+            del coalesce_flights[key]
+
+def _sweep_flights():
+    while True:
+        coalesce_sweep_needed.wait()
+        time.sleep(max(COALESCE_WINDOW_MS, 0) / 1000)
+        with coalesce_lock:
+            _prune_flights(time.monotonic())
+            if not coalesce_flights:
+                coalesce_sweep_needed.clear()
+
+def _start_flight_sweeper():
+    """Start the sweeper thread once; call under coalesce_lock"""
+    global coalesce_sweeper_started
+    if not coalesce_sweeper_started:
+        coalesce_sweeper_started = True
+        threading.Thread(target=_sweep_flights, name='coalesce-sweeper', daemon=True).start()
+
+def coalesce_reads(view):
+    """Share one in-flight execution of a GET among identical concurrent requests.
+
+    The first request for a path + query string runs the view; requests
+    arriving while it runs (or within COALESCE_WINDOW_MS after) receive the
+    same serialised body. A flight is only joined if no write has started
+    since it began, so a read never returns data older than a write that
+    finished before the read arrived. Finished flights are evicted once
+    their window has passed, so distinct query strings do not pile up.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.path, request.query_string)
+        with coalesce_lock:
+            _prune_flights(time.monotonic())
+            flight = coalesce_flights.get(key)
+            joinable = flight is not None and flight.generation == write_generation and (
+                flight.finished_at is None
+                or (flight.result is not None and (time.monotonic() - flight.finished_at) * 1000 <= COALESCE_WINDOW_MS)
+            )
+            if not joinable:
+                flight = coalesce_flights[key] = _Flight(write_generation)
+
+        if not joinable:
+            try:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    flight.result = (response.get_data(), response.mimetype)
+                return response
+            finally:
+                with coalesce_lock:
+                    flight.finished_at = time.monotonic()
+                    if coalesce_flights.get(key) is flight:
+                        if COALESCE_WINDOW_MS <= 0 or flight.result is None:
+                            del coalesce_flights[key]
+                        else:
+                            _start_flight_sweeper()
+                            coalesce_sweep_needed.set()
+                flight.done.set()
+
+        if not flight.done.wait(COALESCE_WAIT_SECONDS) or flight.result is None:
+            return view(*args, **kwargs)
+        body, mimetype = flight.result
+        response = Response(body, mimetype=mimetype)
+        response.headers['X-Coalesced'] = '1'
+        return response
+    return wrapper
 
 # ============ PRODUCTION ORDERS ============
 
 @app.route('/api/orders', methods=['GET'])
+@coalesce_reads
 def get_orders():
-    """Get all production orders"""
+    """Get all production orders (hot tier unless ?include_archived=1)"""
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM production_orders ORDER BY sortOrder ASC, createdAt DESC")
+        source = tiered_table('production_orders', include_archived_requested())
+        cursor.execute(f"SELECT * FROM {source} ORDER BY sortOrder ASC, createdAt DESC")
         orders = cursor.fetchall()
         
         # Convert JSON fields
@@ -146,6 +690,8 @@ def get_orders():
             order['details'] = json.loads(order['details']) if order['details'] else []
             order['stages'] = json.loads(order['stages']) if order['stages'] else []
             order['statusHistory'] = json.loads(order['statusHistory']) if order['statusHistory'] else []
+            if 'archived' in order:
+                order['archived'] = bool(order['archived'])
         
         cursor.close()
         conn.close()
@@ -163,6 +709,10 @@ def create_order():
     
     try:
         cursor = conn.cursor()
+        if archived_order_code_taken(cursor, data['orderCode'], data['id']):
+            cursor.close()
+            conn.close()
+            return jsonify({'error': f"Order code already used by an archived order: {data['orderCode']}"}), 409
         query = """
             INSERT INTO production_orders (
                 id, orderCode, itemCode, modelId, customerId, customerName, gender,
@@ -184,13 +734,15 @@ def create_order():
             data.get('sortOrder', 0), convert_datetime(data.get('createdAt')), data.get('parentOrderId')
         )
         cursor.execute(query, values)
+        apply_defect_counters(cursor, produced=production_contributions(data))
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.upsert_order(data)
+        schedule_engine.upsert_order(data)
         return jsonify({'message': 'Order created successfully', 'id': data['id']}), 201
     except Error as e:
-        print(f"ERROR creating order: {str(e)}")
-        print(f"Data received: {data}")
+        logger.exception("Error creating order", extra={'fields': {'orderId': data.get('id'), 'data': data}})
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/orders/<order_id>', methods=['PUT'])
@@ -202,7 +754,16 @@ def update_order(order_id):
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(dictionary=True)
+        if archived_order_code_taken(cursor, data['orderCode'], order_id):
+            cursor.close()
+            conn.close()
+            return jsonify({'error': f"Order code already used by an archived order: {data['orderCode']}"}), 409
+        cursor.execute(
+            "SELECT itemCode, customerId, bom, details, totalQuantity, orderDate, status FROM production_orders WHERE id=%s FOR UPDATE",
+            (order_id,)
+        )
+        previous = cursor.fetchone()
         query = """
             UPDATE production_orders SET
                 orderCode=%s, itemCode=%s, modelId=%s, customerId=%s, customerName=%s,
@@ -227,24 +788,25 @@ def update_order(order_id):
             data.get('sortOrder', 0), data.get('parentOrderId'), order_id
         )
         cursor.execute(query, values)
+        if previous:
+            apply_defect_counters(cursor, produced=production_delta(previous, data))
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.upsert_order(dict(data, id=order_id))
+        schedule_engine.upsert_order(dict(data, id=order_id))
         return jsonify({'message': 'Order updated successfully'})
     except Error as e:
-        print(f"ERROR updating order {order_id}: {str(e)}")
-        print(f"SQL Error Code: {e.errno}")
-        print(f"SQL Error Message: {e.msg}")
-        print(f"Data keys: {list(data.keys()) if data else 'None'}")
+        logger.exception("Database error updating order", extra={'fields': {
+            'orderId': order_id, 'errno': e.errno, 'sqlMessage': e.msg,
+            'dataKeys': list(data.keys()) if data else None
+        }})
         if conn:
             conn.rollback()
             conn.close()
         return jsonify({'error': f'Database error: {str(e)}'}), 500
     except Exception as e:
-        print(f"ERROR updating order {order_id}: {str(e)}")
-        print(f"Exception type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error updating order", extra={'fields': {'orderId': order_id}})
         if conn:
             conn.rollback()
             conn.close()
@@ -258,28 +820,47 @@ def delete_order(order_id):
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        cursor = conn.cursor()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM production_orders WHERE id=%s FOR UPDATE", (order_id,))
+        order = cursor.fetchone()
+        if order:
+            # Returns go with the order (ON DELETE CASCADE), so their counts go too
+            cursor.execute("SELECT color, size, quantity, date FROM return_logs WHERE originalOrderId=%s", (order_id,))
+            returned = [(return_contributions(order, r['color'], r['size'], r['date']), r['quantity']) for r in cursor.fetchall()]
+            apply_defect_counters(cursor, produced=production_contributions(order), returned=returned, sign=-1)
         cursor.execute("DELETE FROM production_orders WHERE id=%s", (order_id,))
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.remove('order', order_id)
+        schedule_engine.remove_order(order_id)
         return jsonify({'message': 'Order deleted successfully'})
     except Error as e:
+        conn.rollback()
+        conn.close()
         return jsonify({'error': str(e)}), 500
 
 # ============ CUSTOMERS ============
 
 @app.route('/api/customers', methods=['GET'])
+@coalesce_reads
 def get_customers():
-    """Get all customers"""
+    """Get all customers, with the balance carried forward from archived shipping notes"""
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM customers ORDER BY createdAt DESC")
+        cursor.execute("""
+            SELECT c.*, COALESCE(cab.balanceAmount, 0) AS archivedBalance
+            FROM customers c
+            LEFT JOIN customer_archived_balances cab ON cab.customerId = c.id
+            ORDER BY c.createdAt DESC
+        """)
         customers = cursor.fetchall()
+        for customer in customers:
+            customer['archivedBalance'] = float(customer['archivedBalance'])
         cursor.close()
         conn.close()
         return jsonify(customers)
@@ -309,6 +890,7 @@ def create_customer():
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.upsert_customer(data)
         return jsonify({'message': 'Customer created successfully', 'id': data['id']}), 201
     except Error as e:
         return jsonify({'error': str(e)}), 500
@@ -337,28 +919,189 @@ def update_customer(customer_id):
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.upsert_customer(dict(data, id=customer_id))
         return jsonify({'message': 'Customer updated successfully'})
     except Error as e:
         return jsonify({'error': str(e)}), 500
 
+# Timeline sources in tie-break order for entries on the same date
+TIMELINE_KINDS = ('order', 'shipping', 'payment', 'return')
+TIMELINE_MAX_LIMIT = 200
+
+def _encode_timeline_cursor(entry_date, rank, entry_id, balance):
+    raw = json.dumps({'d': entry_date.isoformat(), 'k': rank, 'i': entry_id, 'b': str(balance)})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def _decode_timeline_cursor(token):
+    """Inverse of _encode_timeline_cursor; raises ValueError for anything malformed"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(data, dict) or not all(isinstance(data.get(key), str) for key in ('d', 'i', 'b')):
+            raise ValueError('bad cursor shape')
+        rank = data.get('k')
+        if not isinstance(rank, int) or isinstance(rank, bool) or not 0 <= rank < len(TIMELINE_KINDS):
+            raise ValueError('bad cursor kind')
+        balance = Decimal(data['b'])
+        if not balance.is_finite():
+            raise ValueError('bad cursor balance')
+        return datetime.fromisoformat(data['d']), rank, data['i'], balance
+    except (TypeError, UnicodeDecodeError, binascii.Error, InvalidOperation) as e:
+        raise ValueError(str(e))
+
+def _timeline_keyset(column, id_column, rank, cursor, is_date_column):
+    """WHERE fragment selecting rows strictly after the cursor in (date, kind, id) order"""
+    if cursor is None:
+        return '', ()
+    after, after_rank, after_id, _ = cursor
+    if is_date_column:
+        # DATE rows sort at midnight, so a cursor later in the day excludes the whole day
+        if after.time() != datetime.min.time():
+            return f" AND {column} > %s", (after.date(),)
+        after = after.date()
+    if rank < after_rank:
+        return f" AND {column} > %s", (after,)
+    if rank == after_rank:
+        return f" AND ({column} > %s OR ({column} = %s AND {id_column} > %s))", (after, after, after_id)
+    return f" AND {column} >= %s", (after,)
+
+def _timeline_date(value):
+    return value if isinstance(value, datetime) else datetime.combine(value, datetime.min.time())
+
+@app.route('/api/customers/<customer_id>/timeline', methods=['GET'])
+def get_customer_timeline(customer_id):
+    """Orders, shipping notes, payments and returns of a customer merged by date.
+
+    Each source is read with a keyset query limited to one page, then the
+    sorted streams are k-way merged. The cursor carries the running debt
+    balance (shipping balanceAmount minus payments), so memory per page is
+    bounded by the page size regardless of the customer's history. Payments
+    are never archived, so without include_archived the balance opens with
+    the customer's carried-forward balance of archived shipping notes.
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), TIMELINE_MAX_LIMIT))
+        cursor_token = request.args.get('cursor')
+        page_cursor = _decode_timeline_cursor(cursor_token) if cursor_token else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+    include_archived = include_archived_requested()
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT id, name, code FROM customers WHERE id=%s", (customer_id,))
+        customer = cursor.fetchone()
+        if not customer:
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'Customer not found'}), 404
+
+        carried_forward = Decimal(0)
+        if page_cursor is None and not include_archived:
+            cursor.execute("SELECT balanceAmount FROM customer_archived_balances WHERE customerId=%s", (customer_id,))
+            row = cursor.fetchone()
+            carried_forward = Decimal(row['balanceAmount'] or 0) if row else Decimal(0)
+
+        sources = {
+            'order': (f"""
+                SELECT id, orderDate AS entryDate, orderCode, itemCode, totalQuantity, status
+                FROM {tiered_table('production_orders', include_archived)}
+                WHERE customerId=%s{{keyset}}
+                ORDER BY orderDate, id LIMIT %s
+            """, 'orderDate', 'id', True),
+            'shipping': (f"""
+                SELECT id, shippingDate AS entryDate, orderCode, itemCode, totalQuantity,
+                       totalAmount, depositAmount, balanceAmount
+                FROM {tiered_table('shipping_notes', include_archived)}
+                WHERE customerId=%s{{keyset}}
+                ORDER BY shippingDate, id LIMIT %s
+            """, 'shippingDate', 'id', True),
+            'payment': ("""
+                SELECT id, date AS entryDate, amount, method, note
+                FROM payments
+                WHERE customerId=%s{keyset}
+                ORDER BY date, id LIMIT %s
+            """, 'date', 'id', True),
+            'return': (f"""
+                SELECT r.id, r.date AS entryDate, po.orderCode, r.color, r.size, r.quantity, r.reason
+                FROM {tiered_table('return_logs', include_archived, 'r')}
+                JOIN {tiered_table('production_orders', include_archived, 'po')} ON po.id = r.originalOrderId
+                WHERE po.customerId=%s{{keyset}}
+                ORDER BY r.date, r.id LIMIT %s
+            """, 'r.date', 'r.id', False)
+        }
+
+        streams = []
+        for rank, kind in enumerate(TIMELINE_KINDS):
+            query, date_column, id_column, is_date_column = sources[kind]
+            keyset, keyset_params = _timeline_keyset(date_column, id_column, rank, page_cursor, is_date_column)
+            cursor.execute(query.format(keyset=keyset), (customer_id,) + keyset_params + (limit + 1,))
+            streams.append([(_timeline_date(row['entryDate']), rank, kind, row) for row in cursor.fetchall()])
+        cursor.close()
+        conn.close()
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+    balance = page_cursor[3] if page_cursor else carried_forward
+    entries = []
+    next_cursor = None
+    for entry_date, rank, kind, row in heapq.merge(*streams, key=lambda item: (item[0], item[1])):
+        if len(entries) == limit:
+            last = entries[-1]
+            next_cursor = _encode_timeline_cursor(datetime.fromisoformat(last['date']), TIMELINE_KINDS.index(last['type']), last['id'], balance)
+            break
+        change = Decimal(0)
+        if kind == 'shipping':
+            change = Decimal(row['balanceAmount'] or 0)
+        elif kind == 'payment':
+            change = -Decimal(row['amount'] or 0)
+        balance += change
+        entry = {key: (float(value) if isinstance(value, Decimal) else value)
+                 for key, value in row.items() if key != 'entryDate'}
+        entry.update({
+            'type': kind,
+            'date': entry_date.isoformat(),
+            'balanceChange': float(change),
+            'balance': float(balance)
+        })
+        entries.append(entry)
+
+    result = {
+        'customer': customer,
+        'entries': entries,
+        'nextCursor': next_cursor
+    }
+    if page_cursor is None:
+        result['openingBalance'] = float(carried_forward)
+    return jsonify(result)
+
 # ============ PRODUCT MODELS ============
 
 @app.route('/api/models', methods=['GET'])
+@coalesce_reads
 def get_models():
-    """Get all product models"""
+    """Get all product models (summary: no technical document or edit history)"""
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM product_models ORDER BY createdAt DESC")
+        cursor.execute("""
+            SELECT id, itemCode, productImage, bom, gender, createdAt, updatedAt, isArchived,
+                   COALESCE(JSON_LENGTH(editHistory), 0) AS editHistoryCount,
+                   COALESCE(technicalDocument, '') != '' AS hasTechnicalDocument
+            FROM product_models ORDER BY createdAt DESC
+        """)
         models = cursor.fetchall()
         
         for model in models:
             model['bom'] = json.loads(model['bom']) if model['bom'] else {}
-            model['editHistory'] = json.loads(model['editHistory']) if model['editHistory'] else []
             model['isArchived'] = bool(model['isArchived'])
+            model['hasTechnicalDocument'] = bool(model['hasTechnicalDocument'])
         
         cursor.close()
         conn.close()
@@ -366,6 +1109,33 @@ def get_models():
     except Error as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/models/<model_id>', methods=['GET'])
+def get_model(model_id):
+    """Get one product model with its edit history and technical document"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM product_models WHERE id=%s", (model_id,))
+        model = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        if not model:
+            return jsonify({'error': 'Model not found'}), 404
+        
+        model['bom'] = json.loads(model['bom']) if model['bom'] else {}
+        model['editHistory'] = [
+            dict(entry, evidenceImage=expand_asset_refs(entry['evidenceImage'])) if entry.get('evidenceImage') else entry
+            for entry in (json.loads(model['editHistory']) if model['editHistory'] else [])
+        ]
+        model['technicalDocument'] = expand_asset_refs(model['technicalDocument'] or '')
+        model['isArchived'] = bool(model['isArchived'])
+        return jsonify(model)
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/models', methods=['POST'])
 def create_model():
     """Create a new product model"""
@@ -376,6 +1146,8 @@ def create_model():
     
     try:
         cursor = conn.cursor()
+        edit_history = externalise_edit_history(cursor, data['id'], data.get('editHistory', []))
+        technical_document = externalise_data_urls(cursor, data['id'], data.get('technicalDocument', ''))
         query = """
             INSERT INTO product_models (
                 id, itemCode, productImage, bom, gender, createdAt, updatedAt,
@@ -385,20 +1157,25 @@ def create_model():
         values = (
             data['id'], data['itemCode'], data['productImage'],
             json.dumps(data['bom']), data['gender'], convert_datetime(data.get('createdAt')),
-            convert_datetime(data.get('updatedAt')), json.dumps(data.get('editHistory', [])),
-            data.get('isArchived', False), data.get('technicalDocument', '')
+            convert_datetime(data.get('updatedAt')), json.dumps(edit_history),
+            data.get('isArchived', False), technical_document
         )
         cursor.execute(query, values)
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.upsert_model(data)
         return jsonify({'message': 'Model created successfully', 'id': data['id']}), 201
     except Error as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/models/<model_id>', methods=['PUT'])
 def update_model(model_id):
-    """Update an existing product model"""
+    """Update an existing product model.
+
+    editHistory and technicalDocument are only written when present in the
+    body, since the summary list does not carry them.
+    """
     data = request.json
     conn = get_db_connection()
     if not conn:
@@ -406,21 +1183,22 @@ def update_model(model_id):
     
     try:
         cursor = conn.cursor()
-        query = """
-            UPDATE product_models SET
-                itemCode=%s, productImage=%s, bom=%s, gender=%s, updatedAt=%s,
-                editHistory=%s, isArchived=%s, technicalDocument=%s
-            WHERE id=%s
-        """
-        values = (
+        assignments = "itemCode=%s, productImage=%s, bom=%s, gender=%s, updatedAt=%s, isArchived=%s"
+        values = [
             data['itemCode'], data['productImage'], json.dumps(data['bom']),
-            data['gender'], convert_datetime(data.get('updatedAt')), json.dumps(data.get('editHistory', [])),
-            data.get('isArchived', False), data.get('technicalDocument', ''), model_id
-        )
-        cursor.execute(query, values)
+            data['gender'], convert_datetime(data.get('updatedAt')), data.get('isArchived', False)
+        ]
+        if 'editHistory' in data:
+            assignments += ", editHistory=%s"
+            values.append(json.dumps(externalise_edit_history(cursor, model_id, data['editHistory'] or [])))
+        if 'technicalDocument' in data:
+            assignments += ", technicalDocument=%s"
+            values.append(externalise_data_urls(cursor, model_id, data['technicalDocument'] or ''))
+        cursor.execute(f"UPDATE product_models SET {assignments} WHERE id=%s", tuple(values) + (model_id,))
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.upsert_model(dict(data, id=model_id))
         return jsonify({'message': 'Model updated successfully'})
     except Error as e:
         return jsonify({'error': str(e)}), 500
@@ -438,28 +1216,119 @@ def delete_model(model_id):
         conn.commit()
         cursor.close()
         conn.close()
+        search_index.remove('model', model_id)
         return jsonify({'message': 'Model deleted successfully'})
     except Error as e:
         return jsonify({'error': str(e)}), 500
 
+# ============ MODEL ASSETS ============
+
+# Embedded images (data URLs) are moved out of editHistory and
+# technicalDocument into model_assets on write and stored as "asset:<sha256>"
+DATA_URL_PATTERN = re.compile(r'data:([\w.+/-]+);base64,([A-Za-z0-9+/=\s]+)')
+# Only raster images are served from the API origin; anything else (HTML, SVG, ...) stays inline
+ASSET_MIME_TYPES = ('image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/webp', 'image/bmp')
+ASSET_REF_PATTERN = re.compile(r'asset:([0-9a-f]{64})')
+# Expanded asset URLs sent back by the client are folded back into refs
+ASSET_URL_PATTERN = re.compile(r'(?:https?://[^"\'\s]*?)?/api/assets/([0-9a-f]{64})')
+
+def _store_asset(cursor, model_id, mime_type, encoded):
+    """Save decoded bytes under their content hash; returns the asset id"""
+    content = base64.b64decode(encoded)
+    asset_id = hashlib.sha256(content).hexdigest()
+    # Same bytes, same id: a concurrent save of the same image is a no-op, not an error
+    cursor.execute("""
+        INSERT INTO model_assets (id, modelId, mimeType, data, size, createdAt)
+        VALUES (%s, %s, %s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE id=id
+    """, (asset_id, model_id, mime_type, content, len(content)))
+    return asset_id
+
+def externalise_data_urls(cursor, model_id, text):
+    """Replace embedded data URLs and expanded asset URLs with asset refs"""
+    if not text:
+        return text
+    text = ASSET_URL_PATTERN.sub(lambda m: 'asset:' + m.group(1), text)
+    if 'data:' not in text:
+        return text
+
+    def replace(match):
+        mime_type = match.group(1).lower()
+        if mime_type not in ASSET_MIME_TYPES:
+            return match.group(0)
+        try:
+            return 'asset:' + _store_asset(cursor, model_id, mime_type, re.sub(r'\s+', '', match.group(2)))
+        except (binascii.Error, ValueError):
+            return match.group(0)
+    return DATA_URL_PATTERN.sub(replace, text)
+
+def externalise_edit_history(cursor, model_id, edit_history):
+    """Externalise evidenceImage of every edit log entry"""
+    return [
+        dict(entry, evidenceImage=externalise_data_urls(cursor, model_id, entry['evidenceImage']))
+        if isinstance(entry, dict) and entry.get('evidenceImage') else entry
+        for entry in edit_history
+    ]
+
+def expand_asset_refs(text):
+    """Turn asset refs into absolute URLs the browser can fetch lazily"""
+    if not text:
+        return text
+    return ASSET_REF_PATTERN.sub(lambda m: f"{request.host_url}api/assets/{m.group(1)}", text)
+
+@app.route('/api/assets/<asset_id>', methods=['GET'])
+def get_asset(asset_id):
+    """Serve a stored model asset; content-addressed, so cacheable forever"""
+    if request.headers.get('If-None-Match') == f'"{asset_id}"':
+        return Response(status=304)
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT mimeType, data FROM model_assets WHERE id=%s", (asset_id,))
+        asset = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        if not asset:
+            return jsonify({'error': 'Asset not found'}), 404
+        mime_type = (asset['mimeType'] or '').lower()
+        if mime_type in ASSET_MIME_TYPES:
+            response = Response(bytes(asset['data']), mimetype=mime_type)
+        else:
+            # Stored before non-image data URLs were kept inline: never render it here
+            response = Response(bytes(asset['data']), mimetype='application/octet-stream')
+            response.headers['Content-Disposition'] = f'attachment; filename="{asset_id}"'
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response.headers['ETag'] = f'"{asset_id}"'
+        return response
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
 # ============ SHIPPING NOTES ============
 
 @app.route('/api/shipping', methods=['GET'])
+@coalesce_reads
 def get_shipping_notes():
-    """Get all shipping notes"""
+    """Get all shipping notes (hot tier unless ?include_archived=1)"""
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM shipping_notes ORDER BY createdAt DESC")
+        source = tiered_table('shipping_notes', include_archived_requested())
+        cursor.execute(f"SELECT * FROM {source} ORDER BY createdAt DESC")
         notes = cursor.fetchall()
         
         for note in notes:
             # Convert JSON fields
             note['details'] = json.loads(note['details']) if note.get('details') else []
             note['editHistory'] = json.loads(note['editHistory']) if note.get('editHistory') else []
+            if 'archived' in note:
+                note['archived'] = bool(note['archived'])
             # Convert date fields to ISO format
             if note.get('shippingDate'):
                 note['shippingDate'] = note['shippingDate'].isoformat() if hasattr(note['shippingDate'], 'isoformat') else str(note['shippingDate'])
@@ -519,10 +1388,7 @@ def create_shipping_note():
         conn.close()
         return jsonify({'message': 'Shipping note created successfully', 'id': data['id']}), 201
     except Error as e:
-        print(f"ERROR creating shipping note: {str(e)}")
-        print(f"Data received: {data}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error creating shipping note", extra={'fields': {'noteId': data.get('id'), 'data': data}})
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/shipping/<note_id>', methods=['PUT'])
@@ -568,15 +1434,13 @@ def update_shipping_note(note_id):
         conn.close()
         return jsonify({'message': 'Shipping note updated successfully'})
     except Error as e:
-        print(f"ERROR updating shipping note {note_id}: {str(e)}")
-        print(f"Data received: {data}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error updating shipping note", extra={'fields': {'noteId': note_id, 'data': data}})
         return jsonify({'error': str(e)}), 500
 
 # ============ PAYMENTS ============
 
 @app.route('/api/payments', methods=['GET'])
+@coalesce_reads
 def get_payments():
     """Get all payments"""
     conn = get_db_connection()
@@ -641,15 +1505,17 @@ def create_payment():
 # ============ RETURN LOGS ============
 
 @app.route('/api/returns', methods=['GET'])
+@coalesce_reads
 def get_returns():
-    """Get all return logs"""
+    """Get all return logs (hot tier unless ?include_archived=1)"""
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM return_logs ORDER BY date DESC")
+        source = tiered_table('return_logs', include_archived_requested())
+        cursor.execute(f"SELECT * FROM {source} ORDER BY date DESC")
         returns = cursor.fetchall()
         cursor.close()
         conn.close()
@@ -666,7 +1532,8 @@ def get_returns_by_order(order_id):
     
     try:
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM return_logs WHERE originalOrderId=%s ORDER BY date DESC", (order_id,))
+        source = tiered_table('return_logs', include_archived_requested())
+        cursor.execute(f"SELECT * FROM {source} WHERE originalOrderId=%s ORDER BY date DESC", (order_id,))
         returns = cursor.fetchall()
         cursor.close()
         conn.close()
@@ -733,6 +1600,11 @@ def create_return():
             data['id'], original_order_id, color, size, quantity, reason, date_value
         )
         cursor.execute(query, values)
+        cursor.execute("SELECT itemCode, customerId, bom FROM production_orders WHERE id=%s", (original_order_id,))
+        row = cursor.fetchone()
+        if row:
+            order = {'itemCode': row[0], 'customerId': row[1], 'bom': row[2]}
+            apply_defect_counters(cursor, returned=[(return_contributions(order, color, size, date_value), quantity)])
         conn.commit()
         cursor.close()
         conn.close()
@@ -750,6 +1622,188 @@ def create_return():
             conn.close()
         return jsonify({'error': str(e)}), 500
 
+# Lead time given to a remake order, matching sp_create_remake_order
+REMAKE_LEAD_DAYS = int(os.getenv('REMAKE_LEAD_DAYS', 30))
+
+def _validate_return_line(line):
+    """Normalise a return line in place; return an error message or None"""
+    if not isinstance(line, dict):
+        return 'Invalid line: must be an object'
+    for field in ('color', 'reason'):
+        if not isinstance(line.get(field) or '', str):
+            return f'Invalid {field}: must be a string'
+    if not (line.get('color') or '').strip():
+        return 'Missing or empty required field: color'
+    try:
+        line['size'] = int(line.get('size') or 0)
+        line['quantity'] = int(line.get('quantity') or 0)
+    except (TypeError, ValueError):
+        return 'Invalid size or quantity: must be a number'
+    if line['size'] <= 0:
+        return 'Invalid size: must be greater than 0'
+    if line['quantity'] <= 0:
+        return 'Invalid quantity: must be greater than 0'
+    if not (line.get('reason') or '').strip():
+        return 'Missing or empty required field: reason'
+    return None
+
+def _remake_details(original_details, lines):
+    """Build the color/size grid of a remake order from returned quantities"""
+    sizes_by_color = {}
+    for line in lines:
+        sizes = sizes_by_color.setdefault(line['color'].strip(), {})
+        key = f"size{line['size']}"
+        sizes[key] = sizes.get(key, 0) + line['quantity']
+
+    details = []
+    for row in original_details:
+        returned = sizes_by_color.pop(row.get('color'), None)
+        if not returned:
+            continue
+        sizes = {key: 0 for key in (row.get('sizes') or {})}
+        sizes.update(returned)
+        details.append(dict(row, id=str(uuid.uuid4()), sizes=sizes, total=sum(returned.values())))
+    # Colors that are not on the original grid still get their own row
+    for color, returned in sizes_by_color.items():
+        details.append({'id': str(uuid.uuid4()), 'color': color, 'lining': '', 'sizes': returned, 'total': sum(returned.values())})
+    return details
+
+@app.route('/api/returns/batch', methods=['POST'])
+def create_returns_batch():
+    """Record many return lines for one order and create one remake order, atomically"""
+    data = request.json
+    if not data or not isinstance(data, dict):
+        return jsonify({'error': 'No data provided'}), 400
+
+    original_order_id = data.get('originalOrderId') or data.get('orderId')
+    if not original_order_id:
+        return jsonify({'error': 'Missing required field: originalOrderId'}), 400
+    lines = data.get('lines') or []
+    if not isinstance(lines, list):
+        return jsonify({'error': 'Invalid lines: must be a list'}), 400
+    if not lines:
+        return jsonify({'error': 'Missing required field: lines'}), 400
+    for index, line in enumerate(lines):
+        message = _validate_return_line(line)
+        if message:
+            return jsonify({'error': f'Line {index + 1}: {message}'}), 400
+
+    # Stored like create_return / convert_datetime: the sent wall-clock time, not shifted to server time
+    date_value = stored_datetime(data.get('date') or data.get('returnDate'))
+    create_remake = data.get('createRemake', True)
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        # Lock the original order so concurrent batches pick distinct remake codes
+        cursor.execute("SELECT * FROM production_orders WHERE id=%s FOR UPDATE", (original_order_id,))
+        original = cursor.fetchone()
+        if not original:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': f'Order not found: {original_order_id}'}), 404
+
+        return_rows = [(
+            line.get('id') or str(uuid.uuid4()), original_order_id, line['color'].strip(),
+            line['size'], line['quantity'], line['reason'].strip(),
+            stored_datetime(line['date']) if line.get('date') else date_value
+        ) for line in lines]
+        cursor.executemany("""
+            INSERT INTO return_logs (
+                id, originalOrderId, color, size, quantity, reason, date
+            ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, return_rows)
+        apply_defect_counters(cursor, returned=[
+            (return_contributions(original, row[2], row[3], row[6]), row[4]) for row in return_rows
+        ])
+
+        remake = None
+        if create_remake:
+            cursor.execute("""
+                SELECT orderCode FROM production_orders WHERE orderCode LIKE %s
+                UNION SELECT orderCode FROM production_orders_archive WHERE orderCode LIKE %s
+            """, (original['orderCode'] + '-BÙ%',) * 2)
+            taken = {row['orderCode'] for row in cursor.fetchall()}
+            order_code = original['orderCode'] + '-BÙ'
+            suffix = 2
+            while order_code in taken:
+                order_code = f"{original['orderCode']}-BÙ{suffix}"
+                suffix += 1
+
+            original_stages = json.loads(original['stages']) if original['stages'] else []
+            reasons = list(dict.fromkeys(row[5] for row in return_rows))
+            today = datetime.now()
+            remake = {
+                'id': data.get('remakeOrderId') or str(uuid.uuid4()),
+                'orderCode': order_code,
+                'itemCode': original['itemCode'],
+                'modelId': original['modelId'],
+                'customerId': original['customerId'],
+                'customerName': original['customerName'],
+                'gender': original['gender'],
+                'totalQuantity': sum(row[4] for row in return_rows),
+                'orderDate': today.strftime('%Y-%m-%d'),
+                'deliveryDate': (today + timedelta(days=REMAKE_LEAD_DAYS)).strftime('%Y-%m-%d'),
+                'productImage': original['productImage'],
+                'generalNote': 'Làm bù cho hàng lỗi - Return ID: ' + ', '.join(row[0] for row in return_rows),
+                'bom': json.loads(original['bom']) if original['bom'] else {},
+                'details': _remake_details(json.loads(original['details']) if original['details'] else [], lines),
+                'stages': [{'id': stage.get('id'), 'name': stage.get('name'), 'status': 'pending'}
+                           for stage in original_stages],
+                'priority': 'High',
+                'priorityReason': 'Làm bù cho hàng lỗi: ' + '; '.join(reasons),
+                'status': 'active',
+                'statusNote': '',
+                'statusHistory': [],
+                'sortOrder': 0,
+                'createdAt': today.strftime('%Y-%m-%d %H:%M:%S'),
+                'parentOrderId': original_order_id
+            }
+            cursor.execute("""
+                INSERT INTO production_orders (
+                    id, orderCode, itemCode, modelId, customerId, customerName, gender,
+                    totalQuantity, orderDate, deliveryDate, productImage, generalNote,
+                    bom, details, stages, priority, priorityReason, status, statusNote,
+                    statusHistory, sortOrder, createdAt, parentOrderId
+                ) VALUES (
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                )
+            """, (
+                remake['id'], remake['orderCode'], remake['itemCode'], remake['modelId'],
+                remake['customerId'], remake['customerName'], remake['gender'],
+                remake['totalQuantity'], remake['orderDate'], remake['deliveryDate'],
+                remake['productImage'], remake['generalNote'],
+                json.dumps(remake['bom']), json.dumps(remake['details']), json.dumps(remake['stages']),
+                remake['priority'], remake['priorityReason'], remake['status'], remake['statusNote'],
+                json.dumps(remake['statusHistory']), remake['sortOrder'], remake['createdAt'],
+                remake['parentOrderId']
+            ))
+            apply_defect_counters(cursor, produced=production_contributions(remake))
+
+        conn.commit()
+        cursor.close()
+        conn.close()
+        if remake:
+            search_index.upsert_order(remake)
+            schedule_engine.upsert_order(remake)
+        return jsonify({
+            'message': 'Return logs created successfully',
+            'returnIds': [row[0] for row in return_rows],
+            'remakeOrder': remake
+        }), 201
+    except Exception as e:
+        logger.exception("Error creating return batch", extra={'fields': {'orderId': original_order_id, 'lines': len(lines)}})
+        try:
+            conn.rollback()
+        except:
+            pass
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
 # ============ USERS ============
 
 @app.route('/api/users/login', methods=['POST'])
@@ -867,6 +1921,1450 @@ def delete_user(user_id):
     except Error as e:
         return jsonify({'error': str(e)}), 500
 
+# ============ SEARCH INDEX ============
+
+SEARCH_BOM_FIELDS = ('knifeCode', 'soleCode', 'formCode', 'frameCode')
+
+# Ranking weight per field: codes typed from paper slips outrank free-text names
+SEARCH_FIELD_WEIGHTS = {
+    'orderCode': 10, 'itemCode': 8, 'code': 8, 'phone': 6,
+    'customerName': 5, 'name': 5,
+    'knifeCode': 3, 'soleCode': 3, 'formCode': 3, 'frameCode': 3
+}
+
+def fold_text(value):
+    """Lowercase text and strip Vietnamese diacritics ('Đế Cao' -> 'de cao')"""
+    if value is None:
+        return ''
+    text = str(value).replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn').lower()
+
+def _search_tokens(text):
+    """Split folded text into alphanumeric tokens"""
+    return [token for token in re.split(r'[^0-9a-z]+', text) if token]
+
+def _index_grams(token):
+    """Bigrams and trigrams of a token, so 2-char and longer queries both hit"""
+    if len(token) <= 2:
+        return {token}
+    grams = set()
+    for n in (2, 3):
+        for i in range(len(token) - n + 1):
+            grams.add(token[i:i + n])
+    return grams
+
+def _query_grams(token):
+    """Grams looked up for a query token (trigrams when long enough)"""
+    if len(token) < 3:
+        return {token}
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+def _bom_dict(bom):
+    """BOM may arrive as a dict (request body) or a JSON string (database row)"""
+    if isinstance(bom, dict):
+        return bom
+    try:
+        return json.loads(bom) if bom else {}
+    except (TypeError, ValueError):
+        return {}
+
+class SearchIndex:
+    """In-memory n-gram inverted index over orders, customers and models.
+
+    Loaded from MySQL on the first search, then kept current by the write
+    endpoints so a query only touches the postings for its own n-grams.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._docs = {}
+        self._postings = defaultdict(set)
+
+    def _unindex(self, key):
+        doc = self._docs.pop(key, None)
+        if not doc:
+            return
+        for gram in doc['grams']:
+            bucket = self._postings.get(gram)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._postings[gram]
+
+    def _index(self, entity, doc_id, fields, hit):
+        key = (entity, doc_id)
+        self._unindex(key)
+        folded = {name: fold_text(value) for name, value in fields.items() if value}
+        grams = set()
+        for text in folded.values():
+            for token in _search_tokens(text):
+                grams |= _index_grams(token)
+        for gram in grams:
+            self._postings[gram].add(key)
+        self._docs[key] = {'fields': folded, 'grams': grams, 'hit': hit}
+
+    def _index_order(self, order):
+        bom = _bom_dict(order.get('bom'))
+        fields = {
+            'orderCode': order.get('orderCode'),
+            'itemCode': order.get('itemCode'),
+            'customerName': order.get('customerName')
+        }
+        fields.update({name: bom.get(name) for name in SEARCH_BOM_FIELDS})
+        self._index('order', order['id'], fields, {
+            'type': 'order',
+            'id': order['id'],
+            'label': order.get('orderCode', ''),
+            'subtitle': f"{order.get('itemCode', '')} - {order.get('customerName', '')}",
+            'status': order.get('status')
+        })
+
+    def _index_customer(self, customer):
+        fields = {
+            'name': customer.get('name'),
+            'code': customer.get('code'),
+            'phone': re.sub(r'\D', '', customer.get('phone') or '')
+        }
+        self._index('customer', customer['id'], fields, {
+            'type': 'customer',
+            'id': customer['id'],
+            'label': customer.get('name', ''),
+            'subtitle': customer.get('code', '')
+        })
+
+    def _index_model(self, model):
+        bom = _bom_dict(model.get('bom'))
+        fields = {'itemCode': model.get('itemCode')}
+        fields.update({name: bom.get(name) for name in SEARCH_BOM_FIELDS})
+        self._index('model', model['id'], fields, {
+            'type': 'model',
+            'id': model['id'],
+            'label': model.get('itemCode', ''),
+            'subtitle': bom.get('soleCode', ''),
+            'isArchived': bool(model.get('isArchived'))
+        })
+
+    def ensure_loaded(self):
+        """Build the index from the database once; returns False if unreachable"""
+        if self._loaded:
+            return True
+        with self._lock:
+            if self._loaded:
+                return True
+            conn = get_db_connection()
+            if not conn:
+                return False
+            try:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("SELECT id, orderCode, itemCode, customerName, bom, status FROM production_orders")
+                for order in cursor.fetchall():
+                    self._index_order(order)
+                cursor.execute("SELECT id, name, code, phone FROM customers")
+                for customer in cursor.fetchall():
+                    self._index_customer(customer)
+                cursor.execute("SELECT id, itemCode, bom, isArchived FROM product_models")
+                for model in cursor.fetchall():
+                    self._index_model(model)
+                cursor.close()
+                self._loaded = True
+            finally:
+                conn.close()
+        return True
+
+    def reload(self):
+        """Drop the index and rebuild it from the database"""
+        with self._lock:
+            self._docs = {}
+            self._postings = defaultdict(set)
+            self._loaded = False
+            return self.ensure_loaded()
+
+    def size(self):
+        return len(self._docs)
+
+    # Write hooks are no-ops until the first search loads the index, since
+    # the initial load reads the committed rows anyway.
+    def upsert_order(self, order):
+        with self._lock:
+            if self._loaded:
+                self._index_order(order)
+
+    def upsert_customer(self, customer):
+        with self._lock:
+            if self._loaded:
+                self._index_customer(customer)
+
+    def upsert_model(self, model):
+        with self._lock:
+            if self._loaded:
+                self._index_model(model)
+
+    def remove(self, entity, doc_id):
+        with self._lock:
+            self._unindex((entity, doc_id))
+
+    def search(self, query, limit=20, types=None):
+        """Return hits ranked by field weight and match quality"""
+        tokens = _search_tokens(fold_text(query))
+        lookup = [token for token in tokens if len(token) >= 2]
+        if not lookup:
+            return []
+
+        with self._lock:
+            candidates = None
+            for gram in sorted({g for token in lookup for g in _query_grams(token)},
+                               key=lambda g: len(self._postings.get(g, ()))):
+                postings = self._postings.get(gram)
+                if not postings:
+                    return []
+                candidates = set(postings) if candidates is None else candidates & postings
+                if not candidates:
+                    return []
+
+            results = []
+            for key in candidates:
+                if types and key[0] not in types:
+                    continue
+                doc = self._docs[key]
+                score = 0
+                matched_field = None
+                top_weight = 0
+                for token in tokens:
+                    best = 0
+                    best_field = None
+                    for name, text in doc['fields'].items():
+                        if token not in text:
+                            continue
+                        words = _search_tokens(text)
+                        if token in words:
+                            quality = 3
+                        elif any(word.startswith(token) for word in words):
+                            quality = 2
+                        else:
+                            quality = 1
+                        weight = SEARCH_FIELD_WEIGHTS.get(name, 1) * quality
+                        if weight > best:
+                            best = weight
+                            best_field = name
+                    if not best:
+                        break
+                    score += best
+                    if best > top_weight:
+                        top_weight = best
+                        matched_field = best_field
+                else:
+                    results.append(dict(doc['hit'], score=score, matchedField=matched_field))
+
+        results.sort(key=lambda hit: (-hit['score'], hit['label']))
+        return results[:limit]
+
+search_index = SearchIndex()
+
+@app.route('/api/search', methods=['GET'])
+def search_all():
+    """Diacritic-insensitive search across orders, customers and models"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query parameter: q'}), 400
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    types = {t.strip() for t in request.args.get('type', '').split(',') if t.strip()} or None
+
+    started = time.perf_counter()
+    try:
+        if not search_index.ensure_loaded():
+            return jsonify({'error': 'Database connection failed'}), 500
+        results = search_index.search(query, limit, types)
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'query': query,
+        'results': results,
+        'tookMs': round((time.perf_counter() - started) * 1000, 2)
+    })
+
+# ============ PRODUCTION SCHEDULER ============
+
+# Pairs/day assumed for a stage that has no finished history yet
+SCHEDULE_DEFAULT_THROUGHPUT = float(os.getenv('SCHEDULE_DEFAULT_THROUGHPUT', 300))
+# Slack (days) below which an order is flagged at risk
+SCHEDULE_RISK_BUFFER_DAYS = float(os.getenv('SCHEDULE_RISK_BUFFER_DAYS', 3))
+# Full replan interval, so projections move forward with the clock
+SCHEDULE_REFRESH_SECONDS = int(os.getenv('SCHEDULE_REFRESH_SECONDS', 300))
+# Relative throughput drift that forces a full replan instead of a partial one
+SCHEDULE_THROUGHPUT_TOLERANCE = 0.1
+SCHEDULE_MIN_STAGE_DAYS = 1 / 24
+
+PRIORITY_RANK = {'High': 0, 'Medium': 1, 'Low': 2}
+
+def parse_iso_datetime(value):
+    """Parse an ISO 8601 string or datetime into a naive local datetime"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        try:
+            dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt
+
+def _to_date(value):
+    """Normalise a DATE column value or request date string to a date"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if hasattr(value, 'isoformat'):
+        return value
+    return datetime.strptime(convert_date(value), '%Y-%m-%d').date()
+
+class ProductionScheduler:
+    """Capacity-aware forward scheduler for active production orders.
+
+    Each stage name is one production line whose throughput (pairs/day)
+    is learned from finished stages. Active orders are queued by
+    sortOrder, then priority, then age, and pushed through their remaining
+    stages. The line state before each queue position is checkpointed, so
+    a change to one order only replays the queue from that order onwards.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._orders = {}
+        self._samples = {}
+        self._totals = defaultdict(lambda: [0.0, 0.0])
+        self._throughput = {}
+        self._queue = []
+        self._checkpoints = [{}]
+        self._plan = {}
+        self._computed_at = None
+
+    @staticmethod
+    def _normalize(order):
+        stages = order.get('stages') or []
+        if isinstance(stages, str):
+            stages = json.loads(stages)
+        return {
+            'id': order['id'],
+            'orderCode': order.get('orderCode', ''),
+            'customerName': order.get('customerName', ''),
+            'quantity': int(order.get('totalQuantity') or 0),
+            'deliveryDate': _to_date(order.get('deliveryDate')),
+            'status': order.get('status', 'active'),
+            'priority': order.get('priority', 'Medium'),
+            'sortOrder': int(order.get('sortOrder') or 0),
+            # Same wall-clock form for rows loaded from MySQL and request bodies, so edits keep queue order
+            'createdAt': stored_datetime(order.get('createdAt')),
+            'stages': [{
+                'name': stage.get('name', ''),
+                'status': stage.get('status', 'pending'),
+                'start': parse_iso_datetime(stage.get('startDate')),
+                'end': parse_iso_datetime(stage.get('endDate'))
+            } for stage in stages]
+        }
+
+    @staticmethod
+    def _queue_key(record):
+        return (record['sortOrder'], PRIORITY_RANK.get(record['priority'], 1), record['createdAt'], record['id'])
+
+    @staticmethod
+    def _is_schedulable(record):
+        return record['status'] == 'active' and any(s['status'] != 'done' for s in record['stages'])
+
+    def _set_samples(self, order_id, record):
+        """Replace one order's contribution to the per-stage throughput totals"""
+        for name, (pairs, days) in self._samples.pop(order_id, {}).items():
+            self._totals[name][0] -= pairs
+            self._totals[name][1] -= days
+        if record is None:
+            return
+        samples = {}
+        for stage in record['stages']:
+            if stage['status'] != 'done' or not stage['start'] or not stage['end']:
+                continue
+            days = max((stage['end'] - stage['start']).total_seconds() / 86400, SCHEDULE_MIN_STAGE_DAYS)
+            samples[stage['name']] = (record['quantity'], days)
+            self._totals[stage['name']][0] += record['quantity']
+            self._totals[stage['name']][1] += days
+        self._samples[order_id] = samples
+
+    def _measured_throughput(self):
+        return {name: pairs / days for name, (pairs, days) in self._totals.items() if days > 0 and pairs > 0}
+
+    def _throughput_drifted(self):
+        measured = self._measured_throughput()
+        if measured.keys() != self._throughput.keys():
+            return True
+        return any(abs(rate - self._throughput[name]) > self._throughput[name] * SCHEDULE_THROUGHPUT_TOLERANCE
+                   for name, rate in measured.items())
+
+    def _project(self, record, free, now):
+        """Push one order through its remaining stages, reserving line time"""
+        cursor_time = now
+        stages = []
+        for stage in record['stages']:
+            if stage['status'] == 'done':
+                continue
+            rate = self._throughput.get(stage['name'], SCHEDULE_DEFAULT_THROUGHPUT)
+            duration = timedelta(days=record['quantity'] / rate if rate > 0 else 0)
+            if stage['status'] == 'in_progress' and stage['start']:
+                duration = max(duration - (now - stage['start']), duration * 0.1)
+            start = max(cursor_time, free.get(stage['name'], now))
+            finish = start + duration
+            free[stage['name']] = finish
+            cursor_time = finish
+            stages.append({
+                'name': stage['name'],
+                'status': stage['status'],
+                'projectedStart': start.isoformat(),
+                'projectedFinish': finish.isoformat()
+            })
+
+        delivery = record['deliveryDate']
+        slack_days = None
+        risk_score = 0.0
+        risk_level = 'on_track'
+        if delivery:
+            deadline = datetime.combine(delivery, datetime.max.time())
+            slack_days = (deadline - cursor_time).total_seconds() / 86400
+            risk_score = min(1.0, max(0.0, (SCHEDULE_RISK_BUFFER_DAYS - slack_days) / (2 * SCHEDULE_RISK_BUFFER_DAYS)))
+            if delivery < now.date():
+                risk_level = 'overdue'
+            elif slack_days < 0:
+                risk_level = 'late'
+            elif slack_days < SCHEDULE_RISK_BUFFER_DAYS:
+                risk_level = 'at_risk'
+
+        return {
+            'orderId': record['id'],
+            'orderCode': record['orderCode'],
+            'customerName': record['customerName'],
+            'priority': record['priority'],
+            'sortOrder': record['sortOrder'],
+            'totalQuantity': record['quantity'],
+            'deliveryDate': delivery.isoformat() if delivery else None,
+            'projectedFinish': cursor_time.isoformat(),
+            'slackDays': round(slack_days, 2) if slack_days is not None else None,
+            'riskScore': round(risk_score, 3),
+            'riskLevel': risk_level,
+            'stages': stages
+        }
+
+    def _replay(self, start):
+        """Recompute projections from queue position `start` to the end"""
+        free = dict(self._checkpoints[start])
+        del self._checkpoints[start:]
+        for order_id in self._queue[start:]:
+            self._checkpoints.append(dict(free))
+            self._plan[order_id] = self._project(self._orders[order_id], free, self._computed_at)
+        self._checkpoints.append(free)
+
+    def _rebuild(self):
+        self._computed_at = datetime.now()
+        self._throughput = self._measured_throughput()
+        self._queue = sorted((r['id'] for r in self._orders.values() if self._is_schedulable(r)),
+                             key=lambda order_id: self._queue_key(self._orders[order_id]))
+        self._checkpoints = [{}]
+        self._plan = {}
+        self._replay(0)
+
+    def ensure_loaded(self):
+        """Load orders and plan the full queue once; returns False if unreachable"""
+        if self._loaded:
+            return True
+        with self._lock:
+            if self._loaded:
+                return True
+            conn = get_db_connection()
+            if not conn:
+                return False
+            try:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("""
+                    SELECT id, orderCode, customerName, totalQuantity, deliveryDate, stages,
+                           priority, status, sortOrder, createdAt
+                    FROM production_orders
+                """)
+                for order in cursor.fetchall():
+                    record = self._normalize(order)
+                    self._orders[record['id']] = record
+                    self._set_samples(record['id'], record)
+                cursor.close()
+                self._rebuild()
+                self._loaded = True
+            finally:
+                conn.close()
+        return True
+
+    def reload(self):
+        """Drop all orders and throughput history and replan from the database"""
+        with self._lock:
+            self._orders = {}
+            self._samples = {}
+            self._totals = defaultdict(lambda: [0.0, 0.0])
+            self._loaded = False
+            return self.ensure_loaded()
+
+    def _reposition(self, order_id, record):
+        """Move one order within the queue and replay from the earliest change"""
+        positions = []
+        if order_id in self._plan:
+            old_pos = self._queue.index(order_id)
+            self._queue.pop(old_pos)
+            del self._checkpoints[old_pos + 1:]
+            self._plan.pop(order_id)
+            positions.append(old_pos)
+        if record is not None and self._is_schedulable(record):
+            key = self._queue_key(record)
+            new_pos = bisect.bisect_left([self._queue_key(self._orders[i]) for i in self._queue], key)
+            self._queue.insert(new_pos, order_id)
+            positions.append(new_pos)
+        if positions:
+            self._replay(min(positions))
+
+    def upsert_order(self, order):
+        with self._lock:
+            if not self._loaded:
+                return
+            record = self._normalize(order)
+            self._orders[record['id']] = record
+            self._set_samples(record['id'], record)
+            if self._throughput_drifted():
+                self._rebuild()
+            else:
+                self._reposition(record['id'], record)
+
+    def remove_order(self, order_id):
+        with self._lock:
+            if not self._loaded or order_id not in self._orders:
+                return
+            del self._orders[order_id]
+            self._set_samples(order_id, None)
+            if self._throughput_drifted():
+                self._rebuild()
+            else:
+                self._reposition(order_id, None)
+
+    def snapshot(self):
+        """Return the current plan, replanning fully if it has gone stale"""
+        with self._lock:
+            if (datetime.now() - self._computed_at).total_seconds() > SCHEDULE_REFRESH_SECONDS:
+                self._rebuild()
+            return {
+                'generatedAt': self._computed_at.isoformat(),
+                'throughput': {name: round(rate, 1) for name, rate in self._throughput.items()},
+                'defaultThroughput': SCHEDULE_DEFAULT_THROUGHPUT,
+                'orders': [self._plan[order_id] for order_id in self._queue]
+            }
+
+schedule_engine = ProductionScheduler()
+
+@app.route('/api/schedule', methods=['GET'])
+def get_schedule():
+    """Projected finish date and overdue risk for every active order"""
+    try:
+        if not schedule_engine.ensure_loaded():
+            return jsonify({'error': 'Database connection failed'}), 500
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+    schedule = schedule_engine.snapshot()
+    risk = request.args.get('risk')
+    if risk:
+        levels = set(risk.split(','))
+        schedule['orders'] = [o for o in schedule['orders'] if o['riskLevel'] in levels]
+    return jsonify(schedule)
+
+@app.route('/api/schedule/<order_id>', methods=['GET'])
+def get_order_schedule(order_id):
+    """Projection for a single order"""
+    try:
+        if not schedule_engine.ensure_loaded():
+            return jsonify({'error': 'Database connection failed'}), 500
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+    for order in schedule_engine.snapshot()['orders']:
+        if order['orderId'] == order_id:
+            return jsonify(order)
+    return jsonify({'error': 'Order is not scheduled (not active or all stages done)'}), 404
+
+# ============ ARCHIVING ============
+
+# Completed/cancelled orders older than this move to the *_archive tables
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 200))
+# Pause between batches so the hot tables stay available to the workshop
+ARCHIVE_BATCH_PAUSE = float(os.getenv('ARCHIVE_BATCH_PAUSE', 0.2))
+
+ARCHIVABLE_STATUSES = ('completed', 'cancelled')
+ARCHIVED_TABLES = ('production_orders', 'shipping_notes', 'return_logs')
+
+archive_lock = threading.Lock()
+
+def include_archived_requested():
+    """True when the request asks for the cold tier as well (?include_archived=1)"""
+    return request.args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+def tiered_table(table, include_archived, alias=None):
+    """FROM clause for a hot table, optionally unioned with its archive table"""
+    if not include_archived or table not in ARCHIVED_TABLES:
+        return f"{table} {alias}" if alias else table
+    return f"(SELECT *, 0 AS archived FROM {table} UNION ALL SELECT *, 1 AS archived FROM {table}_archive) AS {alias or 'tiered'}"
+
+def archived_order_code_taken(cursor, order_code, order_id=None):
+    """True if another order already holds order_code in the archive tier.
+
+    orderCode is UNIQUE in both tiers, so a code reused after its order was
+    archived would make that new order impossible to archive later.
+    """
+    cursor.execute(
+        "SELECT id FROM production_orders_archive WHERE orderCode=%s AND id != %s LIMIT 1",
+        (order_code, order_id or '')
+    )
+    return cursor.fetchone() is not None
+
+def _archive_batch(conn, run):
+    """Move one batch of orders with their shipping notes and returns; returns candidate count"""
+    cursor = conn.cursor()
+    status_list = ', '.join(['%s'] * len(ARCHIVABLE_STATUSES))
+    # Plain consistent read: picks candidates without locking the hot table
+    cursor.execute(f"""
+        SELECT po.id FROM production_orders po
+        WHERE po.status IN ({status_list}) AND po.createdAt < %s AND po.id > %s
+          AND NOT EXISTS (SELECT 1 FROM production_orders c WHERE c.parentOrderId = po.id)
+          AND NOT EXISTS (SELECT 1 FROM shipping_notes sn WHERE sn.orderId = po.id AND sn.shippingDate >= %s)
+          AND NOT EXISTS (SELECT 1 FROM return_logs rl WHERE rl.originalOrderId = po.id AND rl.date >= %s)
+        ORDER BY po.id
+        LIMIT %s
+    """, ARCHIVABLE_STATUSES + (run['cutoffDate'], run['lastOrderId'] or '',
+                                run['cutoffDate'], run['cutoffDate'], run['batchSize']))
+    candidates = [row[0] for row in cursor.fetchall()]
+    if not candidates:
+        cursor.close()
+        return 0
+
+    # Short transaction: lock only the batch rows, re-checking their status
+    placeholders = ', '.join(['%s'] * len(candidates))
+    cursor.execute(
+        f"SELECT id FROM production_orders WHERE id IN ({placeholders}) AND status IN ({status_list}) FOR UPDATE",
+        tuple(candidates) + ARCHIVABLE_STATUSES
+    )
+    order_ids = tuple(row[0] for row in cursor.fetchall())
+    if order_ids:
+        # Codes reused before archived codes were reserved would fail the archive's
+        # UNIQUE(orderCode); leave those orders hot instead of failing every retry
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        cursor.execute(f"""
+            SELECT po.id, po.orderCode FROM production_orders po
+            JOIN production_orders_archive pa ON pa.orderCode = po.orderCode AND pa.id != po.id
+            WHERE po.id IN ({placeholders})
+        """, order_ids)
+        collisions = cursor.fetchall()
+        if collisions:
+            logger.warning("Skipping orders whose code is already archived", extra={'fields': {
+                'runId': run['id'], 'orders': [{'id': row[0], 'orderCode': row[1]} for row in collisions]
+            }})
+            skipped = {row[0] for row in collisions}
+            order_ids = tuple(order_id for order_id in order_ids if order_id not in skipped)
+    moved = {'production_orders': 0, 'shipping_notes': 0, 'return_logs': 0}
+    if order_ids:
+        placeholders = ', '.join(['%s'] * len(order_ids))
+        # Payments stay hot, so carry the archived notes' balance forward per customer
+        cursor.execute(
+            f"SELECT customerId, balanceAmount FROM shipping_notes WHERE orderId IN ({placeholders}) FOR UPDATE",
+            order_ids
+        )
+        carried = defaultdict(lambda: [Decimal(0), 0])
+        for customer_id, balance in cursor.fetchall():
+            carried[customer_id][0] += Decimal(balance or 0)
+            carried[customer_id][1] += 1
+        if carried:
+            cursor.executemany("""
+                INSERT INTO customer_archived_balances (customerId, balanceAmount, notesArchived, updatedAt)
+                VALUES (%s, %s, %s, NOW())
+                ON DUPLICATE KEY UPDATE
+                    balanceAmount = balanceAmount + VALUES(balanceAmount),
+                    notesArchived = notesArchived + VALUES(notesArchived),
+                    updatedAt = NOW()
+            """, [(customer_id, total, count) for customer_id, (total, count) in carried.items()])
+        for table, column in (('return_logs', 'originalOrderId'), ('shipping_notes', 'orderId'), ('production_orders', 'id')):
+            cursor.execute(f"INSERT INTO {table}_archive SELECT * FROM {table} WHERE {column} IN ({placeholders})", order_ids)
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", order_ids)
+            moved[table] = cursor.rowcount
+    cursor.execute("""
+        UPDATE archive_runs SET
+            lastOrderId=%s, ordersMoved=ordersMoved+%s, shippingMoved=shippingMoved+%s,
+            returnsMoved=returnsMoved+%s, updatedAt=NOW()
+        WHERE id=%s
+    """, (candidates[-1], moved['production_orders'], moved['shipping_notes'], moved['return_logs'], run['id']))
+    conn.commit()
+    cursor.close()
+
+    bump_write_generation()
+    run['lastOrderId'] = candidates[-1]
+    for order_id in order_ids:
+        search_index.remove('order', order_id)
+        schedule_engine.remove_order(order_id)
+    return len(candidates)
+
+def run_archive(run_id):
+    """Drive an archive run batch by batch until done; safe to call again to resume.
+
+    Returns True once the run is completed, including when an earlier call
+    already finished it. Calls for the same process wait for each other.
+    """
+    archive_lock.acquire()
+    conn = None
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return False
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM archive_runs WHERE id=%s", (run_id,))
+        run = cursor.fetchone()
+        cursor.close()
+        if not run:
+            return False
+        if run['status'] == 'completed':
+            return True
+        cursor = conn.cursor()
+        cursor.execute("UPDATE archive_runs SET status='running', error=NULL, updatedAt=NOW() WHERE id=%s", (run_id,))
+        conn.commit()
+        cursor.close()
+
+        while _archive_batch(conn, run) == run['batchSize']:
+            time.sleep(ARCHIVE_BATCH_PAUSE)
+
+        cursor = conn.cursor()
+        cursor.execute("UPDATE archive_runs SET status='completed', updatedAt=NOW() WHERE id=%s", (run_id,))
+        conn.commit()
+        cursor.close()
+        return True
+    except Error as e:
+        logger.exception("Error in archive run", extra={'fields': {'runId': run_id}})
+        if conn:
+            conn.rollback()
+            cursor = conn.cursor()
+            cursor.execute("UPDATE archive_runs SET status='failed', error=%s, updatedAt=NOW() WHERE id=%s", (str(e), run_id))
+            conn.commit()
+            cursor.close()
+        return False
+    finally:
+        if conn:
+            conn.close()
+        archive_lock.release()
+
+@app.route('/api/archive/run', methods=['POST'])
+def start_archive_run():
+    """Queue a new archive run, or resume the unfinished one, as a background job"""
+    data = request.json or {}
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        # Lock the unfinished run so concurrent requests cannot both queue a job for it
+        cursor.execute("SELECT * FROM archive_runs WHERE status != 'completed' ORDER BY startedAt DESC LIMIT 1 FOR UPDATE")
+        run = cursor.fetchone()
+        job_id = None
+        if run:
+            cursor.execute("""
+                SELECT id FROM jobs
+                WHERE type='archive_orders' AND status IN ('queued', 'running')
+                  AND JSON_UNQUOTE(JSON_EXTRACT(payload, '$.runId')) = %s
+                LIMIT 1
+            """, (run['id'],))
+            active = cursor.fetchone()
+            job_id = active['id'] if active else None
+        else:
+            older_than_days = int(data.get('olderThanDays', ARCHIVE_AFTER_DAYS))
+            run = {
+                'id': str(uuid.uuid4()),
+                'cutoffDate': (datetime.now() - timedelta(days=older_than_days)).strftime('%Y-%m-%d'),
+                'batchSize': int(data.get('batchSize', ARCHIVE_BATCH_SIZE))
+            }
+            cursor.execute("""
+                INSERT INTO archive_runs (id, cutoffDate, batchSize, status, startedAt, updatedAt)
+                VALUES (%s, %s, %s, 'running', NOW(), NOW())
+            """, (run['id'], run['cutoffDate'], run['batchSize']))
+        already_queued = job_id is not None
+        if not already_queued:
+            job_id = insert_job(cursor, 'archive_orders', {'runId': run['id']})
+        conn.commit()
+        cursor.close()
+        conn.close()
+    except Error as e:
+        conn.rollback()
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+    job_runner.start()
+    job_runner.wake()
+    message = 'Archive run already queued' if already_queued else 'Archive run queued'
+    return jsonify({'message': message, 'id': run['id'], 'jobId': job_id, 'cutoffDate': str(run['cutoffDate'])}), 202
+
+@app.route('/api/archive/runs', methods=['GET'])
+def get_archive_runs():
+    """Get recent archive runs and their progress"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM archive_runs ORDER BY startedAt DESC LIMIT 20")
+        runs = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return jsonify(runs)
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ BACKGROUND JOBS ============
+
+JOB_THREAD_WORKERS = int(os.getenv('JOB_THREAD_WORKERS', 2))
+JOB_PROCESS_WORKERS = int(os.getenv('JOB_PROCESS_WORKERS', 1))
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', 2))
+# Retry delay is JOB_RETRY_BASE_SECONDS * 2^(attempt-1)
+JOB_RETRY_BASE_SECONDS = int(os.getenv('JOB_RETRY_BASE_SECONDS', 10))
+JOB_DEFAULT_MAX_ATTEMPTS = 3
+EXPORT_DIR = os.getenv('EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'exports'))
+EXPORTABLE_TABLES = ('production_orders', 'customers', 'product_models', 'shipping_notes', 'payments', 'return_logs')
+
+# type -> (handler, 'thread' | 'process')
+JOB_HANDLERS = {}
+
+def job_handler(job_type, pool='thread'):
+    """Register a job handler.
+
+    Thread handlers are called as handler(payload, progress) and may report
+    progress(percent, message). Process handlers are called as
+    handler(payload) in a worker process, so they must be module-level and
+    open their own database connection.
+    """
+    def register(func):
+        JOB_HANDLERS[job_type] = (func, pool)
+        return func
+    return register
+
+class JobRunner:
+    """In-process job queue backed by the jobs table.
+
+    A dispatcher thread claims due jobs with a conditional UPDATE and hands
+    them to a bounded thread or process pool. Jobs that were running when
+    the server stopped are re-queued on start, and failures are retried
+    with exponential backoff until maxAttempts is reached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self._capacity = {'thread': JOB_THREAD_WORKERS, 'process': JOB_PROCESS_WORKERS}
+        self._in_flight = {'thread': 0, 'process': 0}
+        self._executors = {}
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._executors['thread'] = ThreadPoolExecutor(max_workers=JOB_THREAD_WORKERS, thread_name_prefix='job')
+        self._executors['process'] = ProcessPoolExecutor(max_workers=JOB_PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        threading.Thread(target=self._dispatch_loop, name='job-dispatcher', daemon=True).start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _recover(self):
+        """Re-queue jobs left running by a previous process"""
+        conn = get_db_connection()
+        if not conn:
+            return False
+        cursor = conn.cursor()
+        cursor.execute("UPDATE jobs SET status='queued', runAfter=NOW(), updatedAt=NOW() WHERE status='running'")
+        conn.commit()
+        cursor.close()
+        conn.close()
+        return True
+
+    def _dispatch_loop(self):
+        recovered = False
+        while True:
+            try:
+                if not recovered:
+                    recovered = self._recover()
+                if recovered:
+                    self._claim_and_submit()
+            except Exception as e:
+                logger.exception("Error in job dispatcher")
+            self._wakeup.wait(JOB_POLL_SECONDS)
+            self._wakeup.clear()
+
+    def _claim_and_submit(self):
+        with self._lock:
+            free = {pool: self._capacity[pool] - self._in_flight[pool] for pool in self._capacity}
+        types = [job_type for job_type, (_, pool) in JOB_HANDLERS.items() if free[pool] > 0]
+        if not types:
+            return
+
+        conn = get_db_connection()
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"""
+                SELECT * FROM jobs
+                WHERE status='queued' AND runAfter <= NOW() AND type IN ({', '.join(['%s'] * len(types))})
+                ORDER BY createdAt
+                LIMIT %s
+            """, tuple(types) + (sum(free.values()),))
+            for job in cursor.fetchall():
+                pool = JOB_HANDLERS[job['type']][1]
+                if free[pool] <= 0:
+                    continue
+                # Conditional update: only one dispatcher can win the claim
+                cursor.execute("""
+                    UPDATE jobs SET status='running', attempts=attempts+1, startedAt=NOW(), updatedAt=NOW()
+                    WHERE id=%s AND status='queued'
+                """, (job['id'],))
+                conn.commit()
+                if cursor.rowcount != 1:
+                    continue
+                free[pool] -= 1
+                job['attempts'] += 1
+                self._submit(job, pool)
+            cursor.close()
+        finally:
+            conn.close()
+
+    def _submit(self, job, pool):
+        handler = JOB_HANDLERS[job['type']][0]
+        payload = json.loads(job['payload']) if job['payload'] else {}
+        with self._lock:
+            self._in_flight[pool] += 1
+        if pool == 'process':
+            future = self._executors['process'].submit(handler, payload)
+        else:
+            future = self._executors['thread'].submit(handler, payload, lambda percent, message='': update_job_progress(job['id'], percent, message))
+        future.add_done_callback(lambda f: self._finish(job, pool, f))
+
+    def _finish(self, job, pool, future):
+        with self._lock:
+            self._in_flight[pool] -= 1
+        conn = get_db_connection()
+        if not conn:
+            return
+        try:
+            cursor = conn.cursor()
+            error = future.exception()
+            if error is None:
+                cursor.execute("""
+                    UPDATE jobs SET status='succeeded', result=%s, progress=100, error=NULL,
+                        finishedAt=NOW(), updatedAt=NOW()
+                    WHERE id=%s
+                """, (json.dumps(future.result(), default=str), job['id']))
+            elif job['attempts'] < job['maxAttempts']:
+                delay = JOB_RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1)
+                logger.warning("Job failed, retrying", extra={'fields': {
+                    'jobId': job['id'], 'type': job['type'], 'attempt': job['attempts'],
+                    'retryInSeconds': delay, 'error': str(error)
+                }})
+                cursor.execute("""
+                    UPDATE jobs SET status='queued', error=%s,
+                        runAfter=DATE_ADD(NOW(), INTERVAL %s SECOND), updatedAt=NOW()
+                    WHERE id=%s
+                """, (f"{type(error).__name__}: {error}", delay, job['id']))
+            else:
+                logger.error("Job failed", extra={'fields': {
+                    'jobId': job['id'], 'type': job['type'], 'attempts': job['attempts'], 'error': str(error)
+                }})
+                cursor.execute("""
+                    UPDATE jobs SET status='failed', error=%s, finishedAt=NOW(), updatedAt=NOW()
+                    WHERE id=%s
+                """, (f"{type(error).__name__}: {error}", job['id']))
+            conn.commit()
+            cursor.close()
+        except Error as e:
+            logger.exception("Error recording job result", extra={'fields': {'jobId': job['id']}})
+        finally:
+            conn.close()
+        self.wake()
+
+job_runner = JobRunner()
+
+def update_job_progress(job_id, percent, message=''):
+    """Persist progress reported by a running thread job"""
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE jobs SET progress=%s, progressMessage=%s, updatedAt=NOW() WHERE id=%s",
+            (max(0, min(int(percent), 100)), str(message)[:255], job_id)
+        )
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+def insert_job(cursor, job_type, payload=None, max_attempts=JOB_DEFAULT_MAX_ATTEMPTS):
+    """Insert a queued job in the caller's transaction; the caller commits and wakes the runner"""
+    job_id = str(uuid.uuid4())
+    cursor.execute("""
+        INSERT INTO jobs (id, type, status, payload, maxAttempts, runAfter, createdAt, updatedAt)
+        VALUES (%s, %s, 'queued', %s, %s, NOW(), NOW(), NOW())
+    """, (job_id, job_type, json.dumps(payload or {}), max_attempts))
+    return job_id
+
+def submit_job(job_type, payload=None, max_attempts=JOB_DEFAULT_MAX_ATTEMPTS):
+    """Persist a queued job and wake the dispatcher; returns the job id"""
+    conn = get_db_connection()
+    if not conn:
+        raise Error('Database connection failed')
+    try:
+        cursor = conn.cursor()
+        job_id = insert_job(cursor, job_type, payload, max_attempts)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    job_runner.start()
+    job_runner.wake()
+    return job_id
+
+@job_handler('archive_orders')
+def archive_orders_job(payload, progress):
+    if not run_archive(payload['runId']):
+        raise RuntimeError(f"Archive run {payload['runId']} did not complete")
+    return {'runId': payload['runId']}
+
+@job_handler('rebuild_search_index')
+def rebuild_search_index_job(payload, progress):
+    if not search_index.reload():
+        raise RuntimeError('Database connection failed')
+    return {'documents': search_index.size()}
+
+@job_handler('rebuild_schedule')
+def rebuild_schedule_job(payload, progress):
+    if not schedule_engine.reload():
+        raise RuntimeError('Database connection failed')
+    return {'orders': len(schedule_engine.snapshot()['orders'])}
+
+@job_handler('externalise_model_assets')
+def externalise_model_assets_job(payload, progress):
+    """Move data URLs already stored in product_models into model_assets"""
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('Database connection failed')
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT COUNT(*) AS total FROM product_models")
+        total = cursor.fetchone()['total'] or 1
+        last_id, scanned, updated = '', 0, 0
+        while True:
+            cursor.execute("""
+                SELECT id, editHistory, technicalDocument FROM product_models
+                WHERE id > %s ORDER BY id LIMIT 50
+            """, (last_id,))
+            models = cursor.fetchall()
+            if not models:
+                break
+            for model in models:
+                edit_history = json.loads(model['editHistory']) if model['editHistory'] else []
+                new_history = externalise_edit_history(cursor, model['id'], edit_history)
+                new_document = externalise_data_urls(cursor, model['id'], model['technicalDocument'])
+                if new_history != edit_history or new_document != model['technicalDocument']:
+                    cursor.execute(
+                        "UPDATE product_models SET editHistory=%s, technicalDocument=%s WHERE id=%s",
+                        (json.dumps(new_history), new_document, model['id'])
+                    )
+                    updated += 1
+                conn.commit()
+            bump_write_generation()
+            scanned += len(models)
+            last_id = models[-1]['id']
+            progress(scanned * 100 // total, f'{scanned}/{total} models')
+        cursor.close()
+    finally:
+        conn.close()
+    return {'scanned': scanned, 'updated': updated}
+
+@job_handler('export_table', pool='process')
+def export_table_job(payload):
+    """Dump one table to a JSON file under EXPORT_DIR"""
+    table = payload.get('table')
+    if table not in EXPORTABLE_TABLES:
+        raise ValueError(f'Table cannot be exported: {table}')
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"SELECT * FROM {table}")
+        rows = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{table}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, default=str, ensure_ascii=False)
+    return {'path': path, 'rows': len(rows)}
+
+def _job_row(job):
+    job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """Queue a background job"""
+    data = request.json or {}
+    job_type = data.get('type')
+    if job_type not in JOB_HANDLERS:
+        return jsonify({'error': f'Unknown job type: {job_type}'}), 400
+    try:
+        job_id = submit_job(job_type, data.get('payload'), int(data.get('maxAttempts', JOB_DEFAULT_MAX_ATTEMPTS)))
+        return jsonify({'message': 'Job queued', 'id': job_id}), 202
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def get_jobs():
+    """Get recent jobs, optionally filtered by ?status="""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        status = request.args.get('status')
+        if status:
+            cursor.execute("SELECT * FROM jobs WHERE status=%s ORDER BY createdAt DESC LIMIT 50", (status,))
+        else:
+            cursor.execute("SELECT * FROM jobs ORDER BY createdAt DESC LIMIT 50")
+        jobs = [_job_row(job) for job in cursor.fetchall()]
+        cursor.close()
+        conn.close()
+        return jsonify(jobs)
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get one job's status, progress and result"""
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM jobs WHERE id=%s", (job_id,))
+        job = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(_job_row(job))
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+# ============ DEFECT ANALYTICS ============
+
+# Counters are kept per (dimension, value, month) in defect_counters and
+# updated in the same transaction as the order/return write they reflect
+DEFECT_DIMENSIONS = ('itemCode', 'size', 'color', 'customer', 'soleCode', 'formCode')
+DEFECT_GRANULARITIES = ('month', 'quarter', 'year')
+
+def _month_bucket(value):
+    value = _to_date(value) or datetime.now().date()
+    return value.strftime('%Y-%m')
+
+def production_contributions(order):
+    """Produced pairs per (dimension, value, month) for one order; cancelled orders count zero"""
+    contributions = defaultdict(int)
+    if not order or order.get('status') == 'cancelled':
+        return contributions
+    bucket = _month_bucket(order.get('orderDate'))
+    quantity = int(order.get('totalQuantity') or 0)
+    bom = _bom_dict(order.get('bom'))
+    details = order.get('details') or []
+    if isinstance(details, str):
+        details = json.loads(details)
+
+    contributions[('itemCode', order.get('itemCode') or '', bucket)] += quantity
+    contributions[('customer', order.get('customerId') or '', bucket)] += quantity
+    for name in ('soleCode', 'formCode'):
+        if bom.get(name):
+            contributions[(name, bom[name], bucket)] += quantity
+    for row in details:
+        if row.get('color'):
+            contributions[('color', row['color'].strip(), bucket)] += int(row.get('total') or 0)
+        for size_key, count in (row.get('sizes') or {}).items():
+            if count and size_key.startswith('size'):
+                contributions[('size', size_key[4:], bucket)] += int(count)
+    return contributions
+
+def return_contributions(order, color, size, return_date):
+    """Counter keys touched by one return line of an order"""
+    bucket = _month_bucket(return_date)
+    bom = _bom_dict(order.get('bom'))
+    keys = [
+        ('itemCode', order.get('itemCode') or '', bucket),
+        ('customer', order.get('customerId') or '', bucket),
+        ('color', color.strip(), bucket),
+        ('size', str(size), bucket)
+    ]
+    keys.extend((name, bom[name], bucket) for name in ('soleCode', 'formCode') if bom.get(name))
+    return keys
+
+def apply_defect_counters(cursor, produced=None, returned=None, sign=1):
+    """Add (or with sign=-1 subtract) produced and returned quantities to the counters.
+
+    produced maps counter key -> pairs; returned is a list of (keys, quantity).
+    """
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for key, quantity in (produced or {}).items():
+        deltas[key][0] += sign * quantity
+    for keys, quantity in (returned or []):
+        for key in keys:
+            deltas[key][1] += sign * quantity
+            deltas[key][2] += sign
+    # Sorted so concurrent writers (and the rebuild) lock counter rows in the same order
+    rows = sorted(key + tuple(delta) for key, delta in deltas.items() if any(delta))
+    if not rows:
+        return
+    cursor.executemany("""
+        INSERT INTO defect_counters (dimension, dimValue, bucket, producedQty, returnedQty, returnCount)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            producedQty = producedQty + VALUES(producedQty),
+            returnedQty = returnedQty + VALUES(returnedQty),
+            returnCount = returnCount + VALUES(returnCount)
+    """, rows)
+
+def production_delta(old_order, new_order):
+    """Produced-pair changes between two versions of an order"""
+    delta = defaultdict(int)
+    for key, quantity in production_contributions(new_order).items():
+        delta[key] += quantity
+    for key, quantity in production_contributions(old_order).items():
+        delta[key] -= quantity
+    return {key: quantity for key, quantity in delta.items() if quantity}
+
+def _bucket_label(month, granularity):
+    if granularity == 'year':
+        return month[:4]
+    if granularity == 'quarter':
+        return f"{month[:4]}-Q{(int(month[5:7]) - 1) // 3 + 1}"
+    return month
+
+@app.route('/api/analytics/defects', methods=['GET'])
+def get_defect_analytics():
+    """Top-N defect rates (returned / produced pairs) for one dimension over a month range"""
+    dimension = request.args.get('dimension', 'itemCode')
+    if dimension not in DEFECT_DIMENSIONS:
+        return jsonify({'error': f"Invalid dimension: must be one of {', '.join(DEFECT_DIMENSIONS)}"}), 400
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in DEFECT_GRANULARITIES:
+        return jsonify({'error': f"Invalid granularity: must be one of {', '.join(DEFECT_GRANULARITIES)}"}), 400
+    start = request.args.get('from', '0000-00')
+    end = request.args.get('to', '9999-12')
+    if not re.fullmatch(r'\d{4}-\d{2}', start) or not re.fullmatch(r'\d{4}-\d{2}', end):
+        return jsonify({'error': 'Invalid from/to: expected YYYY-MM'}), 400
+    sort = 'returned' if request.args.get('sort') == 'returned' else 'rate'
+    try:
+        top = max(1, min(int(request.args.get('top', 10)), 100))
+        min_produced = int(request.args.get('minProduced', 1 if sort == 'rate' else 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid top or minProduced'}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+
+    try:
+        cursor = conn.cursor(dictionary=True)
+        order_by = 'returned DESC' if sort == 'returned' else 'returned / NULLIF(produced, 0) DESC, returned DESC'
+        cursor.execute(f"""
+            SELECT dimValue, SUM(producedQty) AS produced, SUM(returnedQty) AS returned,
+                   SUM(returnCount) AS returns
+            FROM defect_counters
+            WHERE dimension=%s AND bucket BETWEEN %s AND %s
+            GROUP BY dimValue
+            HAVING produced >= %s
+            ORDER BY {order_by}
+            LIMIT %s
+        """, (dimension, start, end, min_produced, top))
+        leaders = cursor.fetchall()
+
+        series = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        labels = {}
+        values = [row['dimValue'] for row in leaders]
+        if values:
+            placeholders = ', '.join(['%s'] * len(values))
+            cursor.execute(f"""
+                SELECT dimValue, bucket, producedQty, returnedQty
+                FROM defect_counters
+                WHERE dimension=%s AND dimValue IN ({placeholders}) AND bucket BETWEEN %s AND %s
+                ORDER BY bucket
+            """, (dimension, *values, start, end))
+            for row in cursor.fetchall():
+                point = series[row['dimValue']][_bucket_label(row['bucket'], granularity)]
+                point[0] += row['producedQty']
+                point[1] += row['returnedQty']
+            if dimension == 'customer':
+                cursor.execute(f"SELECT id, name, code FROM customers WHERE id IN ({placeholders})", tuple(values))
+                labels = {row['id']: f"{row['code']} - {row['name']}" for row in cursor.fetchall()}
+        cursor.close()
+        conn.close()
+    except Error as e:
+        return jsonify({'error': str(e)}), 500
+
+    def rate(returned, produced):
+        return round(returned / produced, 4) if produced else None
+
+    results = []
+    for row in leaders:
+        produced, returned = int(row['produced'] or 0), int(row['returned'] or 0)
+        results.append({
+            'value': row['dimValue'],
+            'label': labels.get(row['dimValue'], row['dimValue']),
+            'producedQty': produced,
+            'returnedQty': returned,
+            'returnCount': int(row['returns'] or 0),
+            'defectRate': rate(returned, produced),
+            'series': [
+                {'bucket': bucket, 'producedQty': p, 'returnedQty': r, 'defectRate': rate(r, p)}
+                for bucket, (p, r) in series[row['dimValue']].items()
+            ]
+        })
+
+    return jsonify({
+        'dimension': dimension,
+        'granularity': granularity,
+        'from': start,
+        'to': end,
+        'sort': sort,
+        'results': results
+    })
+
+# MySQL deadlock / lock wait timeout: the bucket is retried
+DEFECT_REBUILD_RETRY_ERRNOS = (1213, 1205)
+DEFECT_REBUILD_ATTEMPTS = 3
+
+def _month_range(bucket):
+    start = datetime.strptime(bucket, '%Y-%m').date()
+    end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start, end
+
+def _rebuild_defect_bucket(conn, bucket):
+    """Recompute one month of counters in one short transaction; returns (orders, returns)"""
+    start, end = _month_range(bucket)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # Delete first: the locks on this month's counter rows make concurrent writers
+        # wait, and the consistent read below starts after the delete, so every change
+        # is either already in the source rows we read or applied on top after commit.
+        for dimension in DEFECT_DIMENSIONS:
+            cursor.execute("DELETE FROM defect_counters WHERE dimension=%s AND bucket=%s", (dimension, bucket))
+
+        orders = []
+        for table in ('production_orders', 'production_orders_archive'):
+            cursor.execute(f"""
+                SELECT itemCode, customerId, bom, details, totalQuantity, orderDate, status
+                FROM {table} WHERE orderDate >= %s AND orderDate < %s
+            """, (start, end))
+            orders.extend(cursor.fetchall())
+        produced = defaultdict(int)
+        for order in orders:
+            for key, quantity in production_contributions(order).items():
+                produced[key] += quantity
+
+        returns = []
+        for returns_table in ('return_logs', 'return_logs_archive'):
+            cursor.execute(f"""
+                SELECT r.color, r.size, r.quantity, r.date,
+                       COALESCE(po.itemCode, pa.itemCode) AS itemCode,
+                       COALESCE(po.customerId, pa.customerId) AS customerId,
+                       COALESCE(po.bom, pa.bom) AS bom
+                FROM {returns_table} r
+                LEFT JOIN production_orders po ON po.id = r.originalOrderId
+                LEFT JOIN production_orders_archive pa ON pa.id = r.originalOrderId
+                WHERE r.date >= %s AND r.date < %s AND (po.id IS NOT NULL OR pa.id IS NOT NULL)
+            """, (start, end))
+            returns.extend(cursor.fetchall())
+
+        apply_defect_counters(cursor, produced=produced, returned=[
+            (return_contributions(row, row['color'], row['size'], row['date']), row['quantity'])
+            for row in returns
+        ])
+        conn.commit()
+        return len(orders), len(returns)
+    except Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+@job_handler('rebuild_defect_counters')
+def rebuild_defect_counters_job(payload, progress):
+    """Recompute defect_counters from all orders and returns, hot and archived.
+
+    Works one month bucket per short transaction, so order and return writes
+    only ever wait for the bucket being rebuilt, never for the whole table.
+    """
+    conn = get_db_connection()
+    if not conn:
+        raise RuntimeError('Database connection failed')
+    try:
+        cursor = conn.cursor()
+        buckets = {datetime.now().strftime('%Y-%m')}
+        for query in (
+            "SELECT DISTINCT DATE_FORMAT(orderDate, '%Y-%m') FROM production_orders",
+            "SELECT DISTINCT DATE_FORMAT(orderDate, '%Y-%m') FROM production_orders_archive",
+            "SELECT DISTINCT DATE_FORMAT(date, '%Y-%m') FROM return_logs",
+            "SELECT DISTINCT DATE_FORMAT(date, '%Y-%m') FROM return_logs_archive",
+            # Buckets with no source rows left still need their stale counters cleared
+            "SELECT DISTINCT bucket FROM defect_counters"
+        ):
+            cursor.execute(query)
+            buckets.update(row[0] for row in cursor.fetchall() if row[0])
+        conn.commit()
+        cursor.close()
+
+        buckets = sorted(buckets)
+        orders = returns = 0
+        for index, bucket in enumerate(buckets):
+            for attempt in range(1, DEFECT_REBUILD_ATTEMPTS + 1):
+                try:
+                    bucket_orders, bucket_returns = _rebuild_defect_bucket(conn, bucket)
+                    break
+                except Error as e:
+                    if e.errno not in DEFECT_REBUILD_RETRY_ERRNOS or attempt == DEFECT_REBUILD_ATTEMPTS:
+                        raise
+                    time.sleep(0.1 * attempt)
+            orders += bucket_orders
+            returns += bucket_returns
+            bump_write_generation()
+            progress((index + 1) * 100 // len(buckets), f'{bucket} ({index + 1}/{len(buckets)} months)')
+    finally:
+        conn.close()
+    return {'months': len(buckets), 'orders': orders, 'returns': returns}
+
 # ============ HEALTH CHECK ============
 
 @app.route('/api/health', methods=['GET'])
@@ -895,10 +3393,22 @@ if __name__ == '__main__':
     print("  - GET  /api/customers")
     print("  - POST /api/customers")
     print("  - PUT  /api/customers/<id>")
+    print("  - GET  /api/customers/<id>/timeline")
     print("  - GET  /api/models")
+    print("  - GET  /api/models/<id>")
     print("  - POST /api/models")
     print("  - PUT  /api/models/<id>")
     print("  - DEL  /api/models/<id>")
+    print("  - POST /api/returns/batch")
+    print("  - GET  /api/search?q=")
+    print("  - GET  /api/schedule")
+    print("  - POST /api/archive/run")
+    print("  - GET  /api/analytics/defects")
+    print("  - POST /api/jobs")
+    print("  - GET  /api/jobs/<id>")
     print("=" * 50)
+    # With the debug reloader only the serving child process runs jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_runner.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
 
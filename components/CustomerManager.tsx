@@ -126,7 +126,8 @@ const CustomerManager: React.FC<Props> = ({ customers, orders, shippingNotes, pa
    };
 
    // Tính nợ hiện tại
-   const totalReceivables = customerShipping.reduce((a, b) => a + b.balanceAmount, 0);
+   // Phiếu giao hàng đã lưu trữ không còn trong danh sách, cộng phần nợ mang sang
+   const totalReceivables = (selectedCustomer?.archivedBalance || 0) + customerShipping.reduce((a, b) => a + b.balanceAmount, 0);
    const totalPaid = customerPayments.reduce((a, b) => a + b.amount, 0);
    const currentDebt = totalReceivables - totalPaid;
 
@@ -433,7 +434,7 @@ const CustomerManager: React.FC<Props> = ({ customers, orders, shippingNotes, pa
                // Tính nợ cho card tổng quát
                const cShipping = shippingNotes.filter(s => s.customerId === customer.id || s.customerName === customer.name);
                const cPayments = payments.filter(p => p.customerId === customer.id);
-               const debt = cShipping.reduce((a, b) => a + b.balanceAmount, 0) - cPayments.reduce((a, b) => a + b.amount, 0);
+               const debt = (customer.archivedBalance || 0) + cShipping.reduce((a, b) => a + b.balanceAmount, 0) - cPayments.reduce((a, b) => a + b.amount, 0);
                const overLimit = debt > customer.debtLimit;
 
                return (
@@ -1,6 +1,6 @@
 
 import React, { useMemo } from 'react';
-import { ProductionOrder, ReturnLog, StageStatus, ShippingNote, Payment } from '../types';
+import { ProductionOrder, ReturnLog, StageStatus, ShippingNote, Payment, Customer } from '../types';
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, Cell } from 'recharts';
 import { ClipboardList, Clock, CheckCircle2, AlertCircle, TrendingUp, Users, Truck, ArrowRight, DollarSign, Wallet } from 'lucide-react';
 import { useNavigate } from 'react-router-dom';
@@ -10,9 +10,10 @@ interface Props {
   returns: ReturnLog[];
   shippingNotes?: ShippingNote[];
   payments?: Payment[];
+  customers?: Customer[];
 }
 
-const Dashboard: React.FC<Props> = ({ orders, returns, shippingNotes = [], payments = [] }) => {
+const Dashboard: React.FC<Props> = ({ orders, returns, shippingNotes = [], payments = [], customers = [] }) => {
   const navigate = useNavigate();
 
   const inProgress = orders.filter(o => o.stages.some(s => s.status === StageStatus.IN_PROGRESS)).length;
@@ -28,7 +29,9 @@ const Dashboard: React.FC<Props> = ({ orders, returns, shippingNotes = [], payme
   }, [orders, shippingNotes]);
 
   // Tính toán số liệu công nợ
-  const totalReceivables = useMemo(() => shippingNotes.reduce((a, b) => a + b.balanceAmount, 0), [shippingNotes]);
+  // Nợ của phiếu đã lưu trữ được mang sang theo từng khách hàng
+  const archivedReceivables = useMemo(() => customers.reduce((a, c) => a + (c.archivedBalance || 0), 0), [customers]);
+  const totalReceivables = useMemo(() => archivedReceivables + shippingNotes.reduce((a, b) => a + b.balanceAmount, 0), [archivedReceivables, shippingNotes]);
   const totalReceived = useMemo(() => payments.reduce((a, b) => a + b.amount, 0), [payments]);
   const remainingDebt = totalReceivables - totalReceived;
 
@@ -18,9 +18,10 @@ interface Props {
   onRestore?: (id: string) => void;
   isArchiveView?: boolean;
   user: User;
+  onLoadDetail?: (id: string) => Promise<ProductModel>;
 }
 
-const ModelManager: React.FC<Props> = ({ models, onAdd, onUpdate, onDelete, onRestore, isArchiveView = false, user }) => {
+const ModelManager: React.FC<Props> = ({ models, onAdd, onUpdate, onDelete, onRestore, isArchiveView = false, user, onLoadDetail }) => {
   const [showForm, setShowForm] = useState(false);
   const [activeTab, setActiveTab] = useState<'info' | 'document' | 'history'>('info');
   const [editingId, setEditingId] = useState<string | null>(null);
@@ -95,9 +96,20 @@ const ModelManager: React.FC<Props> = ({ models, onAdd, onUpdate, onDelete, onRe
     }));
   };
 
-  const startEdit = (model: ProductModel) => {
+  const startEdit = async (model: ProductModel) => {
     if (isArchiveView) return;
-    setNewModel({ ...model });
+    // Danh sách không kèm tài liệu kỹ thuật & lịch sử cải tiến, tải chi tiết khi mở form
+    let detail = model;
+    if (onLoadDetail) {
+      try {
+        detail = await onLoadDetail(model.id);
+      } catch (error) {
+        console.error('Error loading model detail:', error);
+        alert('Lỗi khi tải chi tiết mã hàng!');
+        return;
+      }
+    }
+    setNewModel({ ...detail });
     setEditingId(model.id);
     resetLogFields();
     setActiveTab('info');
@@ -204,8 +216,8 @@ const ModelManager: React.FC<Props> = ({ models, onAdd, onUpdate, onDelete, onRe
              <div className="aspect-square relative overflow-hidden bg-slate-50 border-b-2">
                 <img src={model.productImage} className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-700" alt="" />
                 <div className="absolute top-3 left-3 flex flex-col gap-1">
-                   {model.editHistory && model.editHistory.length > 0 && (
-                      <span className="bg-blue-600 text-white px-2 py-0.5 rounded-full text-[7px] font-black uppercase tracking-widest border border-blue-900 flex items-center gap-1 shadow-md"><History size={8} /> {model.editHistory.length} Cải tiến</span>
+                   {(model.editHistory?.length ?? model.editHistoryCount ?? 0) > 0 && (
+                      <span className="bg-blue-600 text-white px-2 py-0.5 rounded-full text-[7px] font-black uppercase tracking-widest border border-blue-900 flex items-center gap-1 shadow-md"><History size={8} /> {model.editHistory?.length ?? model.editHistoryCount} Cải tiến</span>
                    )}
                 </div>
              </div>
@@ -45,6 +45,21 @@ CREATE TABLE IF NOT EXISTS product_models (
     INDEX idx_archived (isArchived)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ============================================
+-- TABLE: model_assets
+-- Ảnh nhúng (base64) tách ra từ editHistory và technicalDocument,
+-- lưu theo SHA-256 nội dung; mã hàng chỉ giữ tham chiếu "asset:<id>"
+-- ============================================
+CREATE TABLE IF NOT EXISTS model_assets (
+    id CHAR(64) PRIMARY KEY COMMENT 'SHA-256 của nội dung',
+    modelId VARCHAR(36) COMMENT 'Mã hàng đầu tiên tải ảnh này lên',
+    mimeType VARCHAR(100) NOT NULL,
+    data LONGBLOB NOT NULL,
+    size INT NOT NULL,
+    createdAt DATETIME NOT NULL,
+    INDEX idx_modelId (modelId)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- ============================================
 -- TABLE: production_orders
 -- Quản lý lệnh sản xuất
@@ -165,6 +180,87 @@ CREATE TABLE IF NOT EXISTS users (
     INDEX idx_role (role)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- ============================================
+-- ARCHIVE TABLES (cold tier)
+-- Lệnh hoàn thành/hủy cũ cùng phiếu giao hàng và trả hàng của chúng
+-- được chuyển sang đây bởi tiến trình lưu trữ (POST /api/archive/run)
+-- ============================================
+CREATE TABLE IF NOT EXISTS production_orders_archive LIKE production_orders;
+CREATE TABLE IF NOT EXISTS shipping_notes_archive LIKE shipping_notes;
+CREATE TABLE IF NOT EXISTS return_logs_archive LIKE return_logs;
+
+-- ============================================
+-- TABLE: customer_archived_balances
+-- Công nợ mang sang: tổng balanceAmount của các phiếu giao hàng đã chuyển
+-- sang shipping_notes_archive (thanh toán không bị lưu trữ nên vẫn trừ đủ)
+-- ============================================
+CREATE TABLE IF NOT EXISTS customer_archived_balances (
+    customerId VARCHAR(36) PRIMARY KEY,
+    balanceAmount DECIMAL(15,2) NOT NULL DEFAULT 0 COMMENT 'Tổng còn nợ của các phiếu đã lưu trữ',
+    notesArchived INT NOT NULL DEFAULT 0,
+    updatedAt DATETIME NOT NULL,
+    FOREIGN KEY (customerId) REFERENCES customers(id) ON DELETE RESTRICT
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- ============================================
+-- TABLE: archive_runs
+-- Trạng thái các lần chạy lưu trữ (cho phép chạy tiếp khi bị gián đoạn)
+-- ============================================
+CREATE TABLE IF NOT EXISTS archive_runs (
+    id VARCHAR(36) PRIMARY KEY,
+    cutoffDate DATE NOT NULL COMMENT 'Chỉ lưu trữ lệnh tạo trước ngày này',
+    batchSize INT NOT NULL,
+    lastOrderId VARCHAR(36) COMMENT 'Con trỏ keyset: id lệnh cuối đã xử lý',
+    status ENUM('running', 'completed', 'failed') NOT NULL DEFAULT 'running',
+    ordersMoved INT NOT NULL DEFAULT 0,
+    shippingMoved INT NOT NULL DEFAULT 0,
+    returnsMoved INT NOT NULL DEFAULT 0,
+    error TEXT,
+    startedAt DATETIME NOT NULL,
+    updatedAt DATETIME NOT NULL,
+    INDEX idx_status (status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- ============================================
+-- TABLE: defect_counters
+-- Bộ đếm sản lượng / hàng trả theo chiều phân tích và tháng,
+-- cập nhật cùng transaction khi tạo/sửa/xóa lệnh và ghi trả hàng
+-- ============================================
+CREATE TABLE IF NOT EXISTS defect_counters (
+    dimension VARCHAR(20) NOT NULL COMMENT 'itemCode, size, color, customer, soleCode, formCode',
+    dimValue VARCHAR(255) NOT NULL,
+    bucket CHAR(7) NOT NULL COMMENT 'Tháng YYYY-MM',
+    producedQty INT NOT NULL DEFAULT 0 COMMENT 'Số đôi đặt sản xuất (không tính lệnh hủy)',
+    returnedQty INT NOT NULL DEFAULT 0 COMMENT 'Số đôi bị trả',
+    returnCount INT NOT NULL DEFAULT 0 COMMENT 'Số lần trả hàng',
+    PRIMARY KEY (dimension, dimValue, bucket),
+    INDEX idx_dimension_bucket (dimension, bucket)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- ============================================
+-- TABLE: jobs
+-- Hàng đợi tác vụ nền (xuất dữ liệu, lưu trữ, dựng lại chỉ mục...)
+-- ============================================
+CREATE TABLE IF NOT EXISTS jobs (
+    id VARCHAR(36) PRIMARY KEY,
+    type VARCHAR(50) NOT NULL,
+    status ENUM('queued', 'running', 'succeeded', 'failed') NOT NULL DEFAULT 'queued',
+    payload JSON,
+    result JSON,
+    progress INT NOT NULL DEFAULT 0 COMMENT 'Phần trăm hoàn thành',
+    progressMessage VARCHAR(255),
+    attempts INT NOT NULL DEFAULT 0,
+    maxAttempts INT NOT NULL DEFAULT 3,
+    error TEXT,
+    runAfter DATETIME NOT NULL COMMENT 'Thời điểm sớm nhất được chạy (backoff khi thử lại)',
+    createdAt DATETIME NOT NULL,
+    startedAt DATETIME,
+    finishedAt DATETIME,
+    updatedAt DATETIME NOT NULL,
+    INDEX idx_status_runAfter (status, runAfter),
+    INDEX idx_createdAt (createdAt)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- ============================================
 -- INSERT DEFAULT DATA
 -- ============================================
@@ -299,6 +395,11 @@ DELIMITER ;
 CREATE INDEX idx_orders_customer_status ON production_orders(customerId, status);
 CREATE INDEX idx_orders_delivery_status ON production_orders(deliveryDate, status);
 CREATE INDEX idx_shipping_customer_date ON shipping_notes(customerId, shippingDate);
+-- Dòng thời gian khách hàng: trả hàng theo lệnh gốc, sắp theo ngày
+CREATE INDEX idx_returns_order_date ON return_logs(originalOrderId, date);
+-- Dựng lại defect_counters theo từng tháng: đọc lệnh theo khoảng orderDate
+CREATE INDEX idx_orders_order_date ON production_orders(orderDate);
+CREATE INDEX idx_orders_archive_order_date ON production_orders_archive(orderDate);
 
 -- ============================================
 -- COMPLETION MESSAGE
@@ -0,0 +1,167 @@
+"""Order codes stay unique across the hot and archive tiers.
+
+Runs against an in-memory stand-in for the few statements involved, so no
+MySQL server is needed: python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as backend
+
+
+class FakeDatabase:
+    """Hot and archive production_orders, each with UNIQUE(orderCode)"""
+
+    def __init__(self):
+        self.hot = {}
+        self.archive = {}
+
+    def insert(self, table, order):
+        if any(row['orderCode'] == order['orderCode'] for row in table.values()):
+            raise backend.Error(errno=1062, msg=f"Duplicate entry '{order['orderCode']}' for key 'orderCode'")
+        table[order['id']] = order
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self.db, dictionary)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, db, dictionary):
+        self.db = db
+        self.dictionary = dictionary
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, query, params=()):
+        query = ' '.join(query.split())
+        db = self.db
+        self.rows = []
+        if query.startswith('SELECT id FROM production_orders_archive WHERE orderCode=%s'):
+            code, order_id = params
+            self.rows = [(o['id'],) for o in db.archive.values() if o['orderCode'] == code and o['id'] != order_id]
+        elif query.startswith('SELECT po.id FROM production_orders po'):
+            after = params[-4]
+            self.rows = sorted((o['id'],) for o in db.hot.values() if o['status'] == 'completed' and o['id'] > after)
+        elif query.startswith('SELECT id FROM production_orders WHERE id IN'):
+            self.rows = [(i,) for i in params if i in db.hot]
+        elif query.startswith('SELECT po.id, po.orderCode FROM production_orders po JOIN production_orders_archive'):
+            archived = {o['orderCode']: o['id'] for o in db.archive.values()}
+            self.rows = [(i, db.hot[i]['orderCode']) for i in params
+                         if archived.get(db.hot[i]['orderCode'], i) != i]
+        elif query.startswith('INSERT INTO production_orders_archive SELECT'):
+            for order_id in params:
+                db.insert(db.archive, dict(db.hot[order_id]))
+            self.rowcount = len(params)
+        elif query.startswith('DELETE FROM production_orders WHERE id IN'):
+            for order_id in params:
+                db.hot.pop(order_id)
+            self.rowcount = len(params)
+        elif query.startswith('SELECT * FROM production_orders WHERE id=%s FOR UPDATE'):
+            self.rows = [db.hot[params[0]]] if params[0] in db.hot else []
+        elif query.startswith('INSERT INTO production_orders ('):
+            db.insert(db.hot, {'id': params[0], 'orderCode': params[1], 'status': 'active'})
+        elif 'orderCode LIKE' in query:
+            prefix = params[0].rstrip('%')
+            tables = (db.hot, db.archive) if 'production_orders_archive' in query else (db.hot,)
+            codes = {o['orderCode'] for table in tables for o in table.values()
+                     if o['orderCode'].startswith(prefix)}
+            self.rows = [{'orderCode': code} for code in codes]
+
+    def executemany(self, query, rows):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = FakeDatabase()
+    monkeypatch.setattr(backend, 'get_db_connection', database.connect)
+    return database
+
+
+def archive_once(db):
+    run = {'id': 'run-1', 'cutoffDate': '2100-01-01', 'lastOrderId': '', 'batchSize': 100}
+    return backend._archive_batch(db.connect(), run)
+
+
+def order_body(order_id, order_code):
+    return {
+        'id': order_id, 'orderCode': order_code, 'itemCode': 'GD-01', 'customerId': 'c1',
+        'customerName': 'Khách A', 'gender': 'Nam', 'totalQuantity': 12, 'orderDate': '2026-01-05',
+        'deliveryDate': '2026-02-05', 'productImage': '', 'bom': {}, 'details': [], 'stages': [],
+        'priority': 'Medium', 'status': 'active'
+    }
+
+
+def test_archived_code_cannot_be_reused(db):
+    db.insert(db.hot, {'id': 'a', 'orderCode': 'LSX-001', 'status': 'completed'})
+    archive_once(db)
+    assert 'a' in db.archive
+
+    client = backend.app.test_client()
+    response = client.post('/api/orders', json=order_body('b', 'LSX-001'))
+    assert response.status_code == 409
+    assert 'b' not in db.hot
+
+    response = client.put('/api/orders/c', json=order_body('c', 'LSX-001'))
+    assert response.status_code == 409
+
+
+def test_reused_archived_code_does_not_stall_archiving(db):
+    db.insert(db.hot, {'id': 'a', 'orderCode': 'LSX-001', 'status': 'completed'})
+    archive_once(db)
+    # A code reused before the check existed, now old enough to archive again
+    db.insert(db.hot, {'id': 'b', 'orderCode': 'LSX-001', 'status': 'completed'})
+    db.insert(db.hot, {'id': 'c', 'orderCode': 'LSX-002', 'status': 'completed'})
+
+    archive_once(db)
+
+    assert set(db.archive) == {'a', 'c'}
+    assert set(db.hot) == {'b'}
+
+
+def test_remake_suffix_skips_archived_codes(db):
+    db.insert(db.hot, {'id': 'r1', 'orderCode': 'LSX-003-BÙ', 'status': 'completed'})
+    archive_once(db)
+    db.insert(db.hot, {
+        'id': 'o1', 'orderCode': 'LSX-003', 'status': 'completed', 'itemCode': 'GD-01', 'modelId': None,
+        'customerId': 'c1', 'customerName': 'Khách A', 'gender': 'Nam', 'productImage': '',
+        'bom': '{}', 'details': '[]', 'stages': '[]', 'orderDate': '2026-01-05'
+    })
+
+    response = backend.app.test_client().post('/api/returns/batch', json={
+        'originalOrderId': 'o1',
+        'lines': [{'color': 'Đen', 'size': 40, 'quantity': 2, 'reason': 'Bong keo'}]
+    })
+
+    assert response.status_code == 201
+    assert response.get_json()['remakeOrder']['orderCode'] == 'LSX-003-BÙ2'
@@ -153,6 +153,7 @@ export interface Customer {
   address: string;
   debtDays: number; // Số ngày được nợ (VD: 30 ngày)
   debtLimit: number; // Hạn mức nợ tối đa (VD: 500.000.000đ)
+  archivedBalance?: number; // Công nợ mang sang từ các phiếu giao hàng đã lưu trữ
   createdAt: string;
 }
 
@@ -177,6 +178,8 @@ export interface ProductModel {
   editHistory?: EditLog[];
   isArchived?: boolean;
   technicalDocument?: string;
+  editHistoryCount?: number; // Danh sách chỉ trả số lượng, chi tiết lấy qua GET /models/:id
+  hasTechnicalDocument?: boolean;
 }
 
 export interface ProductionOrder {